@@ -0,0 +1,480 @@
+import os
+import io
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+# ==================================================
+# BENCHMARK relief.py (TANPA GOOGLE / FIREBASE / TELEGRAM SEBENAR)
+# ==================================================
+# Contoh:
+#   python bench_relief.py --rows 1000,10000,100000 --latency-ms 150
+#
+# Semua client luar diganti dengan objek palsu dalam memori. Kependaman
+# setiap panggilan API boleh disuntik supaya keputusan lebih realistik.
+
+_TMP = tempfile.mkdtemp(prefix="relief-bench-")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:bench")
+os.environ.setdefault("JOURNAL_PATH", os.path.join(_TMP, "journal.db"))
+os.environ.setdefault("METRICS_PORT", "0")
+
+import relief  # noqa: E402
+
+
+# ==================================================
+# KIRAAN PANGGILAN API
+# ==================================================
+class ApiCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.latency = 0.0
+
+    def hit(self, nama):
+        with self._lock:
+            self.calls[nama] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+api = ApiCounter()
+
+
+# ==================================================
+# GOOGLE SHEET PALSU
+# ==================================================
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows=None):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.rows = rows if rows is not None else [relief_header()]
+
+    @property
+    def row_count(self):
+        return max(len(self.rows), 1000)
+
+    def get_all_values(self):
+        api.hit("sheets.get_all_values")
+        return [list(r) for r in self.rows]
+
+    def get(self, julat, value_render_option=None):
+        api.hit("sheets.get")
+        _, baris0, baris1, kol0, kol1 = parse_julat(f"'{self.title}'!{julat}")
+        return [r[kol0:kol1] for r in self.rows[baris0 - 1:baris1]]
+
+    def insert_row(self, values, index=1, **kwargs):
+        api.hit("sheets.insert_row")
+        self.rows.insert(index - 1, list(values))
+
+    def update(self, *args, **kwargs):
+        api.hit("sheets.update")
+
+
+class FakeApiError(Exception):
+    def __init__(self, status, mesej):
+        super().__init__(mesej)
+        self.response = SimpleNamespace(status_code=status, headers={})
+
+
+def parse_julat(julat):
+    # "'Tab'!A2:I10" / "'Tab'!A2:I" / "'Tab'!A1" -> (tab, baris0, baris1|None, kol0, kol1)
+    tab, sel = julat.rsplit("!", 1)
+    bahagian = sel.split(":")
+    mula, akhir = bahagian[0], bahagian[-1]
+    kol0 = ord(mula[0]) - ord("A")
+    kol1 = ord(akhir[0]) - ord("A") + 1
+    baris0 = int(mula[1:] or 1)
+    baris1 = int(akhir[1:]) if akhir[1:] else None
+    return tab.strip("'"), baris0, baris1, kol0, kol1
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.tabs = {}
+        for i, nama in enumerate(relief.BULAN_MAP.values()):
+            self.tabs[nama] = FakeWorksheet(self, i, nama)
+
+    @property
+    def sheet1(self):
+        return self.tabs[relief.BULAN_MAP[1]]
+
+    def worksheet(self, nama):
+        api.hit("sheets.worksheet")
+        return self.tabs[nama]
+
+    def worksheets(self):
+        api.hit("sheets.worksheets")
+        return list(self.tabs.values())
+
+    def batch_update(self, body):
+        api.hit("sheets.batch_update")
+        by_id = {ws.id: ws for ws in self.tabs.values()}
+        for req in body["requests"]:
+            if "insertDimension" in req:
+                r = req["insertDimension"]["range"]
+                ws = by_id[r["sheetId"]]
+                for _ in range(r["endIndex"] - r["startIndex"]):
+                    ws.rows.insert(r["startIndex"], [])
+            elif "updateCells" in req:
+                u = req["updateCells"]
+                ws = by_id[u["start"]["sheetId"]]
+                for i, row in enumerate(u["rows"]):
+                    ws.rows[u["start"]["rowIndex"] + i] = [
+                        next(iter(c["userEnteredValue"].values())) for c in row["values"]
+                    ]
+            elif "deleteDimension" in req:
+                r = req["deleteDimension"]["range"]
+                del by_id[r["sheetId"]].rows[r["startIndex"]:r["endIndex"]]
+            elif "addSheet" in req:
+                nama = req["addSheet"]["properties"]["title"]
+                self.tabs[nama] = FakeWorksheet(self, len(self.tabs), nama, rows=[])
+
+    def values_batch_get(self, ranges):
+        api.hit("sheets.values_batch_get")
+        hasil = []
+        for julat in ranges:
+            tab, baris0, baris1, kol0, kol1 = parse_julat(julat)
+            if max(baris0, baris1 or 0) > self.tabs[tab].row_count:
+                # seperti Sheets sebenar: julat di luar grid ditolak
+                raise FakeApiError(400, f"Range ({julat}) exceeds grid limits")
+            rows = self.tabs[tab].rows[baris0 - 1:baris1]
+            hasil.append({"range": julat, "values": [r[kol0:kol1] for r in rows]})
+        return {"valueRanges": hasil}
+
+    def values_batch_update(self, body):
+        api.hit("sheets.values_batch_update")
+        for d in body["data"]:
+            tab, baris0, _, kol0, _ = parse_julat(d["range"])
+            ws = self.tabs[tab]
+            for i, values in enumerate(d["values"]):
+                while len(ws.rows) < baris0 + i:
+                    ws.rows.append([])
+                row = ws.rows[baris0 - 1 + i]
+                row.extend([""] * (kol0 - len(row)))
+                row[kol0:kol0 + len(values)] = values
+
+    def values_append(self, julat, params, body):
+        api.hit("sheets.values_append")
+        tab = parse_julat(julat)[0]
+        self.tabs[tab].rows.extend(list(r) for r in body["values"])
+
+
+class FakeGc:
+    def __init__(self):
+        self.spreadsheets = {}
+
+    def open_by_key(self, kunci):
+        api.hit("sheets.open_by_key")
+        return self.spreadsheets.setdefault(kunci, FakeSpreadsheet())
+
+
+def relief_header():
+    return ["Timestamp", "Tarikh", "Masa", "Guru Pengganti", "Guru Diganti",
+            "Kelas", "Subjek", "Gambar 1", "Gambar 2", "Papar 1", "Papar 2"]
+
+
+def isi_data(spreadsheet, bilangan):
+    # Data sintetik untuk bulan semasa & bulan lepas (tempoh 7 hari mungkin
+    # merentas dua tab)
+    hari_ini = date.today()
+    rnd = random.Random(bilangan)
+    for tab_tarikh in (hari_ini, hari_ini.replace(day=1) - timedelta(days=1)):
+        ws = spreadsheet.tabs[relief.nama_tab_bulan(tab_tarikh.strftime("%Y-%m-%d"))]
+        mula = tab_tarikh.replace(day=1)
+        hari = (tab_tarikh - mula).days + 1
+        rows = [relief_header()]
+        for _ in range(bilangan):
+            t = mula + timedelta(days=rnd.randrange(hari))
+            rows.append([
+                f"{t} 08:00:00", t.strftime("%Y-%m-%d"), rnd.choice(relief.MASA_LIST),
+                rnd.choice(relief.GURU_LIST), rnd.choice(relief.GURU_LIST),
+                rnd.choice(relief.KELAS_LIST), rnd.choice(relief.SUBJEK_LIST),
+                "relief/bench_a.jpg", "relief/bench_b.jpg", "", ""
+            ])
+        ws.rows = rows
+
+
+# ==================================================
+# FIREBASE STORAGE PALSU
+# ==================================================
+class FakeBlob:
+    def __init__(self, bucket, path):
+        self.bucket = bucket
+        self.name = path
+        self.chunk_size = None
+
+    def upload_from_file(self, f, size=None, content_type=None):
+        api.hit("storage.upload")
+        self.bucket.objects[self.name] = f.read()
+
+    def generate_signed_url(self, expiration=None, **kwargs):
+        api.hit("storage.sign_url")
+        tarikh = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        return (f"https://storage.invalid/{self.name}?X-Goog-Date={tarikh}"
+                f"&X-Goog-Expires={int(expiration.total_seconds())}&X-Goog-Signature=bench")
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, path):
+        return FakeBlob(self, path)
+
+
+# ==================================================
+# TELEGRAM PALSU
+# ==================================================
+class FakeBot:
+    async def send_document(self, chat_id, document, **kwargs):
+        api.hit("telegram.send_document")
+        return SimpleNamespace(document=SimpleNamespace(file_id=f"bench-{id(document)}"))
+
+
+class FakeApplication:
+    def create_task(self, coroutine, update=None):
+        return asyncio.create_task(coroutine)
+
+
+class FakeMessage:
+    def __init__(self, photo=None, media_group_id=None):
+        self.photo = photo or []
+        self.media_group_id = media_group_id
+
+    async def reply_text(self, *args, **kwargs):
+        api.hit("telegram.reply_text")
+
+    async def reply_document(self, *args, **kwargs):
+        api.hit("telegram.reply_document")
+
+    async def delete(self):
+        api.hit("telegram.delete")
+
+
+class FakeFile:
+    def __init__(self, data):
+        self.data = data
+
+    async def download_as_bytearray(self):
+        api.hit("telegram.download")
+        return bytearray(self.data)
+
+
+class FakePhoto:
+    def __init__(self, data, unique_id):
+        self.data = data
+        self.file_unique_id = unique_id
+
+    async def get_file(self):
+        api.hit("telegram.get_file")
+        return FakeFile(self.data)
+
+
+def fake_update(user_id, message):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=message
+    )
+
+
+def fake_context(user_data=None):
+    return SimpleNamespace(
+        user_data=user_data if user_data is not None else {}, bot=FakeBot(), application=FakeApplication()
+    )
+
+
+def jpeg_palsu():
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        return os.urandom(3 * 1024 * 1024)
+    buf = io.BytesIO()
+    PILImage.new("RGB", (3024, 4032), (120, 160, 200)).save(buf, format="JPEG", quality=95)
+    return buf.getvalue()
+
+
+# ==================================================
+# SENARIO
+# ==================================================
+def reset_cache():
+    # buang semua cache & indeks tenant lalai (client palsu kekal ditampal)
+    relief.tenant_semasa().tutup()
+
+
+async def bench_semak_rekod(panas):
+    if not panas:
+        reset_cache()
+    await relief.semak_rekod(fake_update(1, FakeMessage()), fake_context())
+
+
+async def bench_get_data_7_hari(panas):
+    if not panas:
+        reset_cache()
+    await relief.sheets_io.run(relief.get_data_7_hari)
+
+
+async def bench_bina_pdf(panas):
+    if not panas:
+        reset_cache()
+    await relief.bina_laporan_mingguan()
+
+
+def user_data_checkin():
+    return {
+        "tarikh": date.today().strftime("%Y-%m-%d"),
+        "masa": relief.MASA_LIST[0],
+        "guru_pengganti": relief.GURU_LIST[0],
+        "guru_diganti": relief.GURU_LIST[1],
+        "kelas": relief.KELAS_LIST[0],
+        "subjek": relief.SUBJEK_LIST[0],
+        "images": []
+    }
+
+
+async def bench_gambar(panas):
+    context = fake_context(user_data_checkin())
+    data = JPEG
+    for i in range(2):
+        photo = FakePhoto(data, f"bench{time.perf_counter_ns()}_{i}")
+        await relief.gambar(fake_update(42, FakeMessage([photo])), context)
+    await relief.flusher.flush()
+
+
+async def bench_album(panas):
+    # dua gambar sebagai satu album; masa termasuk tempoh tunggu ALBUM_WAIT
+    context = fake_context(user_data_checkin())
+    kumpulan = f"album{time.perf_counter_ns()}"
+    for i in range(2):
+        photo = FakePhoto(JPEG, f"{kumpulan}_{i}")
+        await relief.gambar(fake_update(43, FakeMessage([photo], media_group_id=kumpulan)), context)
+    await relief.album_tertunda[(43, kumpulan)]["timer"]
+    await relief.flusher.flush()
+
+
+async def bench_eksport(panas):
+    hari_ini = date.today()
+    f, _ = await relief.export_io.run(relief.eksport_fail, hari_ini - timedelta(days=60), hari_ini, "csv")
+    f.close()
+
+
+async def bench_arkib(panas):
+    # pindah rekod lama ke spreadsheet arkib palsu, kemudian baca tab aktif semula
+    tenant = relief.tenant_semasa()
+    tenant.arkib = {str(tahun): f"arkib-{tahun}" for tahun in range(date.today().year - 1, date.today().year + 1)}
+    await relief.arkib_tenant(tenant)
+    await relief.sheets_io.run(relief.record_store.get_tab, date.today().strftime("%Y-%m-%d"))
+
+
+async def bench_keyboard_pengganti(panas):
+    if not panas:
+        reset_cache()
+    await relief.keyboard_pengganti(date.today().strftime("%Y-%m-%d"), relief.MASA_LIST[0])
+
+
+async def bench_refresh_pautan(panas):
+    if not panas:
+        reset_cache()
+    await relief.sheets_io.run(relief.refresh_pautan, relief.bulan_aktif())
+
+
+SENARIO = [
+    ("semak_rekod (sejuk)", bench_semak_rekod, False),
+    ("semak_rekod (panas)", bench_semak_rekod, True),
+    ("get_data_7_hari (sejuk)", bench_get_data_7_hari, False),
+    ("get_data_7_hari (panas)", bench_get_data_7_hari, True),
+    ("bina_pdf (sejuk)", bench_bina_pdf, False),
+    ("gambar (2 foto + flush)", bench_gambar, True),
+    ("album (2 foto + flush)", bench_album, True),
+    ("keyboard_pengganti (sejuk)", bench_keyboard_pengganti, False),
+    ("keyboard_pengganti (panas)", bench_keyboard_pengganti, True),
+    ("eksport csv (60 hari)", bench_eksport, True),
+    ("refresh_pautan (sejuk)", bench_refresh_pautan, False),
+    ("refresh_pautan (panas)", bench_refresh_pautan, True),
+    ("arkib (pindah + baca tab)", bench_arkib, True),
+    ("semak_rekod selepas arkib", bench_semak_rekod, False),
+    ("eksport selepas arkib", bench_eksport, False),
+]
+
+JPEG = b""
+
+
+def buang_had_kuota():
+    # token bucket Sheets (global & per sekolah) diisi penuh: bench mengukur
+    # kerja relief.py, bukan masa tidur menunggu kuota
+    relief.sheets_limiter = relief.SheetsRateLimiter(1e9, 1e9, 1e9)
+    relief.tenant_semasa().limiter = relief.SheetsRateLimiter(1e9, 1e9, 1e9)
+
+
+async def jalankan(bilangan_list, ulangan, hanya):
+    hasil = []
+    for bilangan in bilangan_list:
+        spreadsheet = FakeSpreadsheet()
+        isi_data(spreadsheet, bilangan)
+        relief.get_spreadsheet = lambda: spreadsheet
+        relief.get_bucket = lambda bucket=FakeBucket(): bucket
+        relief.get_gc = lambda gc=FakeGc(): gc
+        relief.tenant_semasa().arkib = {}
+
+        for nama, fn, panas in SENARIO:
+            if hanya and not any(h in nama for h in hanya):
+                continue
+            masa = []
+            for _ in range(ulangan):
+                buang_had_kuota()
+                api.reset()
+                tracemalloc.start()
+                mula = time.perf_counter()
+                await fn(panas)
+                masa.append(time.perf_counter() - mula)
+                _, puncak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            hasil.append((bilangan, nama, min(masa), sorted(masa)[len(masa) // 2], dict(api.calls), puncak))
+    return hasil
+
+
+def cetak(hasil):
+    print(f"{'baris':>7}  {'senario':<26} {'min ms':>9} {'median ms':>10} {'puncak KB':>10}  panggilan API")
+    for bilangan, nama, minimum, median, calls, puncak in hasil:
+        ringkas = ", ".join(f"{k}={v}" for k, v in sorted(calls.items()))
+        print(f"{bilangan:>7}  {nama:<26} {minimum * 1000:>9.1f} {median * 1000:>10.1f} {puncak / 1024:>10.0f}  {ringkas}")
+
+
+def main():
+    global JPEG
+
+    parser = argparse.ArgumentParser(description="Benchmark relief.py dengan client palsu")
+    parser.add_argument("--rows", default="1000,10000,100000", help="bilangan baris setiap tab bulan")
+    parser.add_argument("--latency-ms", type=float, default=0, help="kependaman setiap panggilan API palsu")
+    parser.add_argument("--repeat", type=int, default=3, help="ulangan setiap senario")
+    parser.add_argument("--only", default="", help="tapis senario ikut nama (dipisah koma)")
+    args = parser.parse_args()
+
+    api.latency = args.latency_ms / 1000
+    JPEG = jpeg_palsu()
+    bilangan_list = [int(x) for x in args.rows.split(",") if x]
+    hanya = [x for x in args.only.split(",") if x]
+
+    try:
+        hasil = asyncio.run(jalankan(bilangan_list, args.repeat, hanya))
+    finally:
+        relief.tutup_chart_pool()
+
+    cetak(hasil)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
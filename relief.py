@@ -1,21 +1,35 @@
+import time
+_T0 = time.perf_counter()
 import os
+import io
+import re
+import sys
+import csv
 import json
-from datetime import datetime, date, timedelta
+import random
+import tempfile
+import asyncio
+import sqlite3
+import contextvars
+import functools
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, date, timedelta, time as dtime
+from urllib.parse import urlparse, unquote, parse_qs
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+from telegram.ext import BaseUpdateProcessor, BasePersistence, PersistenceInput, TypeHandler, ApplicationHandlerStop
+from telegram.request import HTTPXRequest
 
-import firebase_admin
-from firebase_admin import credentials, storage
-from reportlab.platypus import KeepTogether
-
-import gspread
-from google.oauth2.service_account import Credentials
+import pytz
 from collections import Counter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import cm
-import matplotlib.pyplot as plt
+
+# PATCH: firebase_admin, gspread, reportlab, matplotlib & PIL hanya diimport
+# bila benar-benar diperlukan (lihat LAZY CLIENT / bina_pdf / render_bar)
 
 
 # ==================================================
@@ -23,8 +37,10 @@ import matplotlib.pyplot as plt
 # ==================================================
 TOKEN = os.environ["TELEGRAM_BOT_TOKEN"]
 SHEET_ID = "1bBnCG5ODsqQspRj_-fViRIXJGMo0w7hgbTH6p56gNuM"
-SHEET_URL = "https://docs.google.com/spreadsheets/d/1bBnCG5ODsqQspRj_-fViRIXJGMo0w7hgbTH6p56gNuM/edit"
 FIREBASE_BUCKET = "relief-31bc6.firebasestorage.app"
+NAMA_SEKOLAH = "SK LABU BESAR"
+MOTO_SEKOLAH = "Sinergi Ke Arah Lonjakan Bestari"
+TAGAR_SEKOLAH = "#LabuBest"
 
 ADMIN_IDS = [
     522707506,
@@ -37,27 +53,570 @@ ADMIN_IDS = [
 
 
 # ==================================================
-# FIREBASE INIT
+# MASA STARTUP
 # ==================================================
-firebase_creds = credentials.Certificate(
-    json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT_JSON"])
-)
-firebase_admin.initialize_app(firebase_creds, {"storageBucket": FIREBASE_BUCKET})
-bucket = storage.bucket()
+# STARTUP_PROFILE=1 (atau `python relief.py --profile-startup`) cetak
+# tempoh setiap fasa init supaya cold start dyno boleh dipantau.
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE") == "1"
+
+
+class StartupTimer:
+    def __init__(self):
+        self.phases = []
+
+    def rekod(self, nama, tempoh):
+        self.phases.append((nama, tempoh))
+        if STARTUP_PROFILE:
+            print(f"⏱ {nama}: {tempoh * 1000:.0f} ms")
+
+    @contextmanager
+    def phase(self, nama):
+        mula = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.rekod(nama, time.perf_counter() - mula)
+
+    def laporan(self):
+        baris = [f"{nama:<28} {tempoh * 1000:>8.0f} ms" for nama, tempoh in self.phases]
+        baris.append(f"{'JUMLAH':<28} {sum(t for _, t in self.phases) * 1000:>8.0f} ms")
+        return "\n".join(baris)
+
+
+startup_timer = StartupTimer()
+startup_timer.rekod("import modul", time.perf_counter() - _T0)
+
+
+# ==================================================
+# METRIK (LATENCY / RALAT / KUOTA SHEETS / LAG EVENT LOOP)
+# ==================================================
+# Dipaparkan di http://127.0.0.1:METRICS_PORT/metrics (format Prometheus)
+# dan melalui arahan /stats (admin sahaja). METRICS_PORT=0 -> tiada HTTP.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, nilai):
+        for i, had in enumerate(self.buckets):
+            if nilai <= had:
+                self.counts[i] += 1
+        self.total += nilai
+        self.count += 1
+        self.max = max(self.max, nilai)
+
+    def purata(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.errors = Counter()
+        self.sheets_requests = Counter()
+        self._sheets_minit = {"read": deque(), "write": deque()}
+        self.loop_lag = Histogram()
+
+    def observe(self, jenis, nama, tempoh, ok=True):
+        with self._lock:
+            self.latency.setdefault((jenis, nama), Histogram()).observe(tempoh)
+            if not ok:
+                self.errors[(jenis, nama)] += 1
+
+    def ralat(self, jenis, nama):
+        with self._lock:
+            self.errors[(jenis, nama)] += 1
+
+    @contextmanager
+    def timer(self, jenis, nama):
+        mula = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(jenis, nama, time.perf_counter() - mula, ok)
+
+    def sheets_request(self, jenis):
+        now = time.monotonic()
+        with self._lock:
+            self.sheets_requests[jenis] += 1
+            q = self._sheets_minit[jenis]
+            q.append(now)
+            while q and q[0] < now - 60:
+                q.popleft()
+
+    def sheets_seminit(self, jenis):
+        now = time.monotonic()
+        with self._lock:
+            q = self._sheets_minit[jenis]
+            while q and q[0] < now - 60:
+                q.popleft()
+            return len(q)
+
+    def prometheus(self):
+        baris = []
+        with self._lock:
+            baris.append("# TYPE relief_latency_seconds histogram")
+            for (jenis, nama), h in sorted(self.latency.items()):
+                label = f'kind="{jenis}",name="{nama}"'
+                for had, c in zip(h.buckets, h.counts):
+                    baris.append(f'relief_latency_seconds_bucket{{{label},le="{had}"}} {c}')
+                baris.append(f'relief_latency_seconds_bucket{{{label},le="+Inf"}} {h.count}')
+                baris.append(f"relief_latency_seconds_sum{{{label}}} {h.total:.6f}")
+                baris.append(f"relief_latency_seconds_count{{{label}}} {h.count}")
+
+            baris.append("# TYPE relief_errors_total counter")
+            for (jenis, nama), c in sorted(self.errors.items()):
+                baris.append(f'relief_errors_total{{kind="{jenis}",name="{nama}"}} {c}')
+
+            baris.append("# TYPE relief_sheets_requests_total counter")
+            for jenis, c in sorted(self.sheets_requests.items()):
+                baris.append(f'relief_sheets_requests_total{{type="{jenis}"}} {c}')
+
+            h = self.loop_lag
+            baris.append("# TYPE relief_event_loop_lag_seconds histogram")
+            for had, c in zip(h.buckets, h.counts):
+                baris.append(f'relief_event_loop_lag_seconds_bucket{{le="{had}"}} {c}')
+            baris.append(f'relief_event_loop_lag_seconds_bucket{{le="+Inf"}} {h.count}')
+            baris.append(f"relief_event_loop_lag_seconds_sum {h.total:.6f}")
+            baris.append(f"relief_event_loop_lag_seconds_count {h.count}")
+
+        baris.append("# TYPE relief_sheets_requests_last_minute gauge")
+        for jenis in ("read", "write"):
+            baris.append(f'relief_sheets_requests_last_minute{{type="{jenis}"}} {self.sheets_seminit(jenis)}')
+
+        return "\n".join(baris) + "\n"
+
+    def ringkasan(self):
+        baris = []
+        with self._lock:
+            for (jenis, nama), h in sorted(self.latency.items()):
+                ralat = self.errors.get((jenis, nama), 0)
+                baris.append(
+                    f"{jenis}/{nama}: n={h.count} avg={h.purata() * 1000:.0f}ms "
+                    f"max={h.max * 1000:.0f}ms err={ralat}"
+                )
+            lag = self.loop_lag
+            baris.append(f"event loop lag: avg={lag.purata() * 1000:.0f}ms max={lag.max * 1000:.0f}ms")
+        baris.append(
+            f"sheets/minit: read={self.sheets_seminit('read')} write={self.sheets_seminit('write')}"
+        )
+        return "\n".join(baris)
+
+
+metrics = Metrics()
+
+
+def diukur(fn):
+    # Pembalut masa untuk handler Telegram
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with metrics.timer("handler", fn.__name__):
+            return await fn(*args, **kwargs)
+
+    return wrapper
+
+
+class MeteredRequest(HTTPXRequest):
+    # Ukur setiap panggilan Bot API (sendMessage, editMessageText, ...)
+    async def do_request(self, url, method, *args, **kwargs):
+        if "/file/bot" in url:
+            nama = "downloadFile"
+        else:
+            nama = url.rsplit("/", 1)[-1]
+        with metrics.timer("telegram", nama):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+async def loop_lag_monitor():
+    loop = asyncio.get_running_loop()
+    while True:
+        mula = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics.loop_lag.observe(max(0.0, loop.time() - mula - LOOP_LAG_INTERVAL))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def mula_metrics_server():
+    if not METRICS_PORT:
+        return None
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), MetricsHandler)
+    except OSError as e:
+        print("METRICS ERROR:", e)
+        return None
+    threading.Thread(target=server.serve_forever, name="relief-metrics", daemon=True).start()
+    return server
+
+
+# ==================================================
+# SINGLE-FLIGHT (GABUNG BACAAN SERENTAK YANG SAMA)
+# ==================================================
+# Bila ramai guru tekan butang yang sama serentak, hanya SATU panggilan
+# dibuat untuk setiap kunci; yang lain menunggu & terima hasil yang sama.
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, kunci, fn):
+        with self._lock:
+            call = self._calls.get(kunci)
+            pemimpin = call is None
+            if pemimpin:
+                call = self._calls[kunci] = _Flight()
+
+        if not pemimpin:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[kunci]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, kunci, coro_fn):
+        task = self._tasks.get(kunci)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[kunci] = task
+
+            def selesai(t, kunci=kunci):
+                if self._tasks.get(kunci) is t:
+                    del self._tasks[kunci]
+
+            task.add_done_callback(selesai)
+        # shield: pembatalan seorang pemanggil tidak membatalkan yang lain
+        return await asyncio.shield(task)
+
+
+# ==================================================
+# KLIEN SHEETS (HAD KUOTA, RETRY, KEUTAMAAN TULIS)
+# ==================================================
+# Token bucket ikut kuota Sheets (baca & tulis berasingan). Bila ada
+# penulisan menunggu, bacaan beri laluan dahulu. Ralat 429/5xx & ralat
+# rangkaian dicuba semula dengan exponential backoff + jitter; 429 juga
+# menahan semua panggilan seketika supaya kuota sempat pulih. Penulisan
+# hanya dicuba semula atas jawapan 429/5xx atau bila sambungan langsung
+# tidak terbina: selepas timeout, Google mungkin sudah menerimanya. Semua
+# cubaan & penantian sesuatu penulisan mesti selesai dalam
+# SHEETS_WRITE_BUDGET saat (jauh di bawah SHEETS_TIMEOUT).
+SHEETS_READ_PER_MIN = float(os.environ.get("SHEETS_READ_PER_MIN", "60"))
+SHEETS_WRITE_PER_MIN = float(os.environ.get("SHEETS_WRITE_PER_MIN", "60"))
+SHEETS_BURST = float(os.environ.get("SHEETS_BURST", "10"))
+SHEETS_MAX_RETRY = int(os.environ.get("SHEETS_MAX_RETRY", "5"))
+SHEETS_BACKOFF_BASE = float(os.environ.get("SHEETS_BACKOFF_BASE", "1"))
+SHEETS_BACKOFF_MAX = float(os.environ.get("SHEETS_BACKOFF_MAX", "32"))
+SHEETS_WRITE_BUDGET = float(os.environ.get("SHEETS_WRITE_BUDGET", "45"))
+SHEETS_HTTP_TIMEOUT = float(os.environ.get("SHEETS_HTTP_TIMEOUT", "30"))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class SheetsRateLimiter:
+    def __init__(self, read_per_min=SHEETS_READ_PER_MIN, write_per_min=SHEETS_WRITE_PER_MIN, burst=SHEETS_BURST):
+        self._cond = threading.Condition()
+        self._kadar = {"read": read_per_min / 60, "write": write_per_min / 60}
+        self._burst = burst
+        self._token = {"read": burst, "write": burst}
+        self._dikemas = time.monotonic()
+        self._tulis_menunggu = 0
+        self._tahan_hingga = 0.0
+
+    def _isi(self, now):
+        lalu = now - self._dikemas
+        self._dikemas = now
+        for jenis, kadar in self._kadar.items():
+            self._token[jenis] = min(self._burst, self._token[jenis] + lalu * kadar)
+
+    def acquire(self, jenis, tamat=None):
+        # tamat: time.monotonic() terakhir yang dibenarkan untuk menunggu
+        tulis = jenis == "write"
+        with self._cond:
+            if tulis:
+                self._tulis_menunggu += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._isi(now)
+                    if now < self._tahan_hingga:
+                        tunggu = self._tahan_hingga - now
+                    elif not tulis and self._tulis_menunggu:
+                        tunggu = 0.05
+                    elif self._token[jenis] >= 1:
+                        self._token[jenis] -= 1
+                        return
+                    else:
+                        tunggu = (1 - self._token[jenis]) / self._kadar[jenis]
+                    if tamat is not None and now + tunggu > tamat:
+                        raise TimeoutError(f"kuota Sheets ({jenis}) tidak pulih dalam had masa")
+                    self._cond.wait(timeout=max(tunggu, 0.01))
+            finally:
+                if tulis:
+                    self._tulis_menunggu -= 1
+                    self._cond.notify_all()
+
+    def tahan(self, saat):
+        with self._cond:
+            self._tahan_hingga = max(self._tahan_hingga, time.monotonic() + saat)
+
+
+sheets_limiter = SheetsRateLimiter()
+
+
+def status_ralat(e):
+    return getattr(getattr(e, "response", None), "status_code", None)
+
+
+def boleh_cuba_semula(e, jenis="read"):
+    status = status_ralat(e)
+    if status is not None:
+        return status in RETRY_STATUS
+    if jenis == "write":
+        # insertDimension / values_append tidak idempotent: ReadTimeout dsb.
+        # boleh berlaku selepas Google menulis baris
+        from requests.exceptions import ConnectTimeout
+        return isinstance(e, ConnectTimeout)
+    # requests.ConnectionError / Timeout ialah subclass OSError
+    return isinstance(e, OSError)
+
+
+def tempoh_backoff(cubaan, e):
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("Retry-After", ""))
+    except ValueError:
+        retry_after = 0.0
+    had = min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** cubaan)
+    return max(retry_after, random.uniform(had / 2, had))
+
+
+def panggil_sheets(jenis, nama, fn, *args, **kwargs):
+    # Semua panggilan gspread melalui sini: had kuota, retry, metrik
+    tamat = time.monotonic() + SHEETS_WRITE_BUDGET if jenis == "write" else None
+    for cubaan in range(SHEETS_MAX_RETRY + 1):
+        # kuota sekolah dahulu: sekolah yang sibuk tidak menghabiskan
+        # kuota projek yang dikongsi semua sekolah
+        tenant_semasa().limiter.acquire(jenis, tamat)
+        sheets_limiter.acquire(jenis, tamat)
+        metrics.sheets_request(jenis)
+        try:
+            with metrics.timer("sheets", nama):
+                return fn(*args, **kwargs)
+        except Exception as e:
+            if cubaan >= SHEETS_MAX_RETRY or not boleh_cuba_semula(e, jenis):
+                raise
+            tunggu = tempoh_backoff(cubaan, e)
+            if status_ralat(e) == 429:
+                sheets_limiter.tahan(tunggu)
+            if tamat is not None and time.monotonic() + tunggu > tamat:
+                # penulisan tidak boleh melepasi had masa pemanggilnya
+                raise
+            print(f"SHEETS RETRY {nama} ({cubaan + 1}/{SHEETS_MAX_RETRY}) dalam {tunggu:.1f}s:", e)
+            time.sleep(tunggu)
+
+
+class WorksheetClient:
+    def __init__(self, worksheet):
+        self._ws = worksheet
+
+    def __getattr__(self, nama):
+        # id, title, dll. terus dari gspread.Worksheet
+        return getattr(self._ws, nama)
+
+    def get_all_values(self):
+        return panggil_sheets("read", "get_all_values", self._ws.get_all_values)
+
+    def get_values(self, julat):
+        return panggil_sheets("read", "get", self._ws.get, julat)
+
+    def get_formulas(self, julat):
+        return panggil_sheets("read", "get_formulas", self._ws.get, julat, value_render_option="FORMULA")
+
+
+# Metadata tab (spreadsheet.worksheet(nama)) jarang berubah: disimpan
+# WORKSHEET_CACHE_TTL saat & carian serentak digabungkan.
+WORKSHEET_CACHE_TTL = float(os.environ.get("WORKSHEET_CACHE_TTL", "3600"))
+
+_worksheet_memo = {}
+_worksheet_memo_lock = threading.Lock()
+_worksheet_flight = SingleFlight()
+
+
+class SheetsClient:
+    def __init__(self, spreadsheet):
+        self._ss = spreadsheet
+
+    def _memo(self, nama, fn):
+        kunci = (getattr(self._ss, "id", id(self._ss)), nama)
+        with _worksheet_memo_lock:
+            entry = _worksheet_memo.get(kunci)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+        def muat():
+            ws = WorksheetClient(fn())
+            with _worksheet_memo_lock:
+                _worksheet_memo[kunci] = (time.monotonic() + WORKSHEET_CACHE_TTL, ws)
+            return ws
+
+        return _worksheet_flight.do(kunci, muat)
+
+    def worksheet(self, nama):
+        return self._memo(nama, lambda: panggil_sheets("read", "worksheet", self._ss.worksheet, nama))
+
+    @property
+    def sheet1(self):
+        return self._memo("__sheet1__", lambda: panggil_sheets("read", "sheet1", lambda: self._ss.sheet1))
+
+    def batch_update(self, body):
+        return panggil_sheets("write", "batch_update", self._ss.batch_update, body)
+
+    def values_batch_update(self, body):
+        return panggil_sheets("write", "values_batch_update", self._ss.values_batch_update, body)
+
+    def senarai_tab(self):
+        # tajuk semua tab dalam satu panggilan metadata
+        return {ws.title for ws in panggil_sheets("read", "worksheets", self._ss.worksheets)}
+
+    def values_batch_get(self, ranges):
+        return panggil_sheets("read", "values_batch_get", self._ss.values_batch_get, ranges)
+
+    def values_append(self, julat, rows):
+        return panggil_sheets(
+            "write", "values_append", self._ss.values_append, julat,
+            {"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"}, {"values": rows}
+        )
+
+    def pastikan_tab(self, nama, header):
+        try:
+            return self.worksheet(nama)
+        except Exception as e:
+            if boleh_cuba_semula(e):
+                raise
+        self.batch_update({"requests": [{"addSheet": {"properties": {"title": nama}}}]})
+        self.values_batch_update({
+            "valueInputOption": "RAW",
+            "data": [{"range": f"'{nama}'!A1", "values": [header]}]
+        })
+        return self.worksheet(nama)
 
 
 # ==================================================
-# GOOGLE SHEET INIT
+# LAZY CLIENT (FIREBASE / GOOGLE SHEET)
 # ==================================================
+# Client dibina sekali sahaja, pada panggilan pertama, bukan semasa import.
+def lazy_client(fn):
+    lock = threading.Lock()
+    hasil = []
+
+    @functools.wraps(fn)
+    def wrapper():
+        if not hasil:
+            with lock:
+                if not hasil:
+                    with startup_timer.phase(fn.__name__):
+                        hasil.append(fn())
+        return hasil[0]
+
+    return wrapper
+
+
+@lazy_client
+def get_firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    firebase_creds = credentials.Certificate(
+        json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT_JSON"])
+    )
+    return firebase_admin.initialize_app(firebase_creds)
+
+
+def get_bucket():
+    # satu app Firebase dikongsi; handle bucket dibuka sekali bagi setiap sekolah
+    tenant = tenant_semasa()
+
+    def buka():
+        from firebase_admin import storage
+        return storage.bucket(tenant.bucket, app=get_firebase_app())
+
+    return tenant.state("bucket", buka)
+
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-sheet_creds = Credentials.from_service_account_info(
-    json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"]), scopes=SCOPES
-)
-gc = gspread.authorize(sheet_creds)
 
-# PATCH: kekalkan sheet asal + tambah akses spreadsheet
-spreadsheet = gc.open_by_key(SHEET_ID)
-sheet = spreadsheet.sheet1   # JANUARI (default)
+
+@lazy_client
+def get_gc():
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    sheet_creds = Credentials.from_service_account_info(
+        json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"]), scopes=SCOPES
+    )
+    gc = gspread.authorize(sheet_creds)
+    # permintaan yang tergantung tidak boleh memegang kunci_tulis selama-lamanya
+    gc.set_timeout(SHEETS_HTTP_TIMEOUT)
+    return gc
+
+
+def get_spreadsheet():
+    # PATCH: kekalkan sheet asal + tambah akses spreadsheet
+    tenant = tenant_semasa()
+    return tenant.state(
+        "spreadsheet",
+        lambda: panggil_sheets("read", "open_by_key", get_gc().open_by_key, tenant.sheet_id)
+    )
+
+
+def get_sheets_client():
+    return SheetsClient(get_spreadsheet())
 
 
 # ==================================================
@@ -89,7 +648,215 @@ KELAS_LIST = ["1 Amber", "1 Amethyst", "1 Aquamarine", "2 Amber", "2 Amethyst",
 SUBJEK_LIST = ["Bahasa Melayu", "Bahasa Inggeris", "Bahasa Arab", "Sains", "Sejarah", "Matematik",
                "RBT", "PJPK", "PSV", "Muzik", "Moral", "Pendidikan Islam"]
 
-def header_footer(canvas, doc):
+
+# ==================================================
+# TENANT (BERBILANG SEKOLAH)
+# ==================================================
+# Satu proses melayan banyak sekolah. Setiap sekolah (tenant) ada sheet,
+# bucket, admin, senarai guru/kelas/subjek dan kuota Sheets sendiri.
+# Client, cache & indeks dibuka bila mula diguna dan dibuang selepas
+# TENANT_IDLE_TTL saat tanpa update. Tanpa TENANTS_JSON, satu tenant
+# "default" dibina daripada CONFIG & DATA di atas.
+# TENANTS_JSON: [{"kunci": "...", "nama": "SK ...", "sheet_id": "...",
+#                 "bucket": "...", "admin_ids": [...], "chats": [...],
+#                 "guru": [...], "kelas": [...], "subjek": [...],
+#                 "moto": "...", "tagar": "#...",
+#                 "arkib": {"2026": "<sheet_id>"}}, ...]
+TENANTS_JSON = os.environ.get("TENANTS_JSON", "")
+# spreadsheet arkib tenant lalai ikut tahun, cth. {"2026": "<sheet_id>"}
+ARCHIVE_SHEETS = json.loads(os.environ.get("ARCHIVE_SHEETS_JSON", "{}"))
+TENANT_DEFAULT = os.environ.get("TENANT_DEFAULT", "")
+TENANT_IDLE_TTL = float(os.environ.get("TENANT_IDLE_TTL", "3600"))
+TENANT_EVICT_INTERVAL = float(os.environ.get("TENANT_EVICT_INTERVAL", "300"))
+# Kuota Sheets setiap sekolah: secara lalai TENANT_QUOTA_SHARE daripada
+# kuota projek, supaya satu sekolah tidak boleh menghabiskan semuanya
+TENANT_QUOTA_SHARE = float(os.environ.get("TENANT_QUOTA_SHARE", "0.5")) if TENANTS_JSON else 1.0
+TENANT_READ_PER_MIN = float(os.environ.get("TENANT_READ_PER_MIN", str(SHEETS_READ_PER_MIN * TENANT_QUOTA_SHARE)))
+TENANT_WRITE_PER_MIN = float(os.environ.get("TENANT_WRITE_PER_MIN", str(SHEETS_WRITE_PER_MIN * TENANT_QUOTA_SHARE)))
+
+
+class Tenant:
+    def __init__(self, kunci, nama, sheet_id, bucket, admin_ids, chats, guru, kelas, subjek, arkib=None,
+                 moto=MOTO_SEKOLAH, tagar=TAGAR_SEKOLAH):
+        self.kunci = kunci
+        self.nama = nama
+        self.moto = moto
+        self.tagar = tagar
+        self.sheet_id = sheet_id
+        self.bucket = bucket
+        self.admin_ids = list(admin_ids)
+        self.chats = list(chats)
+        self.guru = list(guru)
+        self.kelas = list(kelas)
+        self.subjek = list(subjek)
+        self.arkib = dict(arkib or {})
+        self.limiter = SheetsRateLimiter(TENANT_READ_PER_MIN, TENANT_WRITE_PER_MIN)
+        self.terakhir = time.monotonic()
+        self._state = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._generasi = 0
+
+    @classmethod
+    def dari_dict(cls, d):
+        return cls(
+            d["kunci"], d.get("nama", d["kunci"]), d["sheet_id"], d["bucket"],
+            d.get("admin_ids", []), d.get("chats", []),
+            d.get("guru", GURU_LIST), d.get("kelas", KELAS_LIST), d.get("subjek", SUBJEK_LIST),
+            d.get("arkib", {}), d.get("moto", MOTO_SEKOLAH), d.get("tagar", TAGAR_SEKOLAH)
+        )
+
+    @property
+    def sheet_url(self):
+        return f"https://docs.google.com/spreadsheets/d/{self.sheet_id}/edit"
+
+    def sentuh(self):
+        self.terakhir = time.monotonic()
+
+    def state(self, nama, buat):
+        # client / cache sekolah ini, dibina sekali pada panggilan pertama.
+        # buat() (cth. open_by_key dengan retry) berjalan DI LUAR kunci:
+        # event loop guna kunci yang sama melalui TenantLocal & kunci_tulis()
+        with self._lock:
+            if nama in self._state:
+                return self._state[nama]
+            generasi = self._generasi
+
+        def bina():
+            nilai = buat()
+            with self._lock:
+                if generasi != self._generasi:
+                    # tutup() semasa membina: jangan simpan client lama
+                    return nilai
+                if not self._state:
+                    self.terakhir = time.monotonic()
+                return self._state.setdefault(nama, nilai)
+
+        return self._flight.do((generasi, nama), bina)
+
+    def terbuka(self):
+        with self._lock:
+            return bool(self._state)
+
+    def tutup(self):
+        with self._lock:
+            self._state.clear()
+            self._generasi += 1
+        with _worksheet_memo_lock:
+            for kunci in [k for k in _worksheet_memo if k[0] == self.sheet_id]:
+                del _worksheet_memo[kunci]
+
+    @functools.cached_property
+    def keyboard_guru_pengganti(self):
+        return grid_keyboard(self.guru, "gp", cols=3, emoji="🟢")
+
+    @functools.cached_property
+    def keyboard_guru_diganti(self):
+        return grid_keyboard(self.guru, "gd", cols=3, emoji="🔴")
+
+    @functools.cached_property
+    def keyboard_kelas(self):
+        return grid_keyboard(self.kelas, "k", cols=3)
+
+    @functools.cached_property
+    def keyboard_subjek(self):
+        return grid_keyboard(self.subjek, "s", cols=2)
+
+
+class TenantPool:
+    def __init__(self, tenants, lalai=""):
+        self._tenants = {t.kunci: t for t in tenants}
+        self._chats = {c: t for t in tenants for c in t.chats}
+        self._lalai = lalai
+
+    def dapatkan(self, kunci):
+        return self._tenants.get(kunci)
+
+    def lalai(self):
+        return self._tenants.get(self._lalai)
+
+    def semua(self):
+        return list(self._tenants.values())
+
+    def terbuka(self):
+        return [t for t in self._tenants.values() if t.terbuka()]
+
+    def untuk_update(self, update):
+        # kumpulan sekolah dahulu, kemudian chat peribadi guru
+        for sumber in (update.effective_chat, update.effective_user):
+            if sumber is not None and sumber.id in self._chats:
+                return self._chats[sumber.id]
+        return self.lalai()
+
+
+def muat_tenant():
+    if not TENANTS_JSON:
+        tenant = Tenant(
+            "default", NAMA_SEKOLAH, SHEET_ID, FIREBASE_BUCKET, ADMIN_IDS, [],
+            GURU_LIST, KELAS_LIST, SUBJEK_LIST, ARCHIVE_SHEETS
+        )
+        return TenantPool([tenant], "default")
+    return TenantPool([Tenant.dari_dict(d) for d in json.loads(TENANTS_JSON)], TENANT_DEFAULT)
+
+
+tenant_pool = muat_tenant()
+tenant_aktif = contextvars.ContextVar("tenant_aktif", default=None)
+
+
+def tenant_semasa():
+    tenant = tenant_aktif.get() or tenant_pool.lalai()
+    if tenant is None:
+        raise RuntimeError("tiada tenant aktif")
+    return tenant
+
+
+@contextmanager
+def guna_tenant(tenant):
+    token = tenant_aktif.set(tenant)
+    try:
+        yield tenant
+    finally:
+        tenant_aktif.reset(token)
+
+
+class TenantLocal:
+    # Objek per sekolah (cache, indeks) di sebalik nama global lama:
+    # record_store.get_tab(...) guna RecordStore milik tenant semasa.
+    def __init__(self, nama, buat):
+        self._nama = nama
+        self._buat = buat
+
+    def untuk(self, tenant=None):
+        return (tenant or tenant_semasa()).state(self._nama, self._buat)
+
+    def __getattr__(self, attr):
+        return getattr(self.untuk(), attr)
+
+
+async def pilih_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # group -1: tetapkan sekolah bagi seluruh pemprosesan update ini
+    tenant = tenant_pool.untuk_update(update)
+    tenant_aktif.set(tenant)
+    if tenant is None:
+        if update.effective_message is not None:
+            await update.effective_message.reply_text("⛔ Chat ini belum didaftarkan kepada mana-mana sekolah.")
+        raise ApplicationHandlerStop
+    tenant.sentuh()
+
+
+async def usir_tenant_loop():
+    while True:
+        await asyncio.sleep(TENANT_EVICT_INTERVAL)
+        had = time.monotonic() - TENANT_IDLE_TTL
+        for tenant in tenant_pool.terbuka():
+            # rekod belum di-flush perlukan client sekolah itu
+            if tenant.terakhir < had and not journal.count(tenant.kunci):
+                tenant.tutup()
+                print(f"💤 Tenant {tenant.kunci} ditutup (terbiar)")
+
+def header_footer(canvas, doc, nama_sekolah=NAMA_SEKOLAH, moto=MOTO_SEKOLAH, tagar=TAGAR_SEKOLAH):
+    from reportlab.lib.units import cm
+
     canvas.saveState()
 
     # ===== HEADER =====
@@ -97,7 +864,7 @@ def header_footer(canvas, doc):
     canvas.drawCentredString(
         doc.pagesize[0] / 2,
         doc.pagesize[1] - 1.5 * cm,
-        "RELIEF CHECK-IN TRACKER SK LABU BESAR"
+        f"RELIEF CHECK-IN TRACKER {nama_sekolah}"
     )
 
     # Garis bawah header
@@ -113,12 +880,12 @@ def header_footer(canvas, doc):
     canvas.drawCentredString(
         doc.pagesize[0] / 2,
         1.5 * cm,
-        "Sinergi Ke Arah Lonjakan Bestari"
+        moto
     )
     canvas.drawCentredString(
         doc.pagesize[0] / 2,
         1.0 * cm,
-        "#LabuBest"
+        tagar
     )
 
     canvas.restoreState()
@@ -136,73 +903,99 @@ def get_guru_tiada_ganti(guru_list, guru_ganti_counter):
 
 
 
-def get_data_7_hari():
+def senarai_7_hari():
     hari_ini = date.today()
     mula = hari_ini - timedelta(days=6)
+    return [(mula + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
 
-    kelas = Counter()
-    subjek = Counter()
-    guru_ganti = Counter()
-    guru_diganti = Counter()
 
-    for i in range(7):
-        tarikh = mula + timedelta(days=i)
-        tarikh_iso = tarikh.strftime("%Y-%m-%d")
-        sheet = get_sheet_by_month(tarikh_iso)
+def get_data_7_hari():
+    # PATCH: jumlahkan 7 bucket harian yang telah dikira (tiada imbasan baris)
+    return rollup_store.jumlah(senarai_7_hari())
+
+def render_bar(labels, values, tajuk):
+    from matplotlib.figure import Figure
+
+    # Figure terus (tanpa state global pyplot), hasil PNG dalam memori
+    fig = Figure(figsize=(8,4))
+    ax = fig.subplots()
+    ax.bar(range(len(labels)), values)
+    ax.set_title(tajuk)
+    ax.set_xticks(range(len(labels)))
+    ax.set_xticklabels(labels, rotation=30, ha="right")
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+def render_bar_vektor(labels, values, tajuk):
+    from reportlab.graphics.shapes import Drawing, String
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    from reportlab.lib import colors
+
+    # Drawing terus masuk story PDF: vektor, tanpa matplotlib / PNG
+    d = Drawing(400, 200)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 40, 60
+    chart.width, chart.height = 340, 110
+    chart.data = [values]
+    chart.bars[0].fillColor = colors.HexColor("#1f77b4")
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.valueStep = max(1, -(-max(values) // 5))
+    chart.categoryAxis.categoryNames = [l if len(l) <= 24 else l[:22] + "..." for l in labels]
+    chart.categoryAxis.labels.angle = 30
+    chart.categoryAxis.labels.boxAnchor = "ne"
+    chart.categoryAxis.labels.fontSize = 7
+    d.add(chart)
+    d.add(String(200, 185, tajuk, textAnchor="middle", fontName="Helvetica-Bold", fontSize=10))
+    return d
+
+
+def data_bar(counter, top=5):
+    data = counter.most_common(top)
 
-        rows = sheet.get_all_values()
-        data = rows[1:] if len(rows) > 1 else []
+    labels = [d[0] for d in data]
+    values = [d[1] for d in data]
 
-        for r in data:
-            if len(r) < 7 or r[1] != tarikh_iso:
-                continue
-            kelas[r[5]] += 1
-            subjek[r[6]] += 1
-            guru_ganti[r[3]] += 1
-            guru_diganti[r[4]] += 1
+    return labels, values
 
-    return kelas, subjek, guru_ganti, guru_diganti
 
-def plot_bar(counter, tajuk, filename, top=5):
-    data = counter.most_common(top)
-    if not data:
-        return None
+def data_bar_kurang(counter, bottom=5):
+    data = [(k, v) for k, v in counter.items() if v > 0]
+    data = sorted(data, key=lambda x: x[1])[:bottom]
 
     labels = [d[0] for d in data]
     values = [d[1] for d in data]
 
-    plt.figure(figsize=(8,4))
-    plt.bar(labels, values)
-    plt.title(tajuk)
-    plt.xticks(rotation=30, ha="right")
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    return labels, values
 
-    return filename
 
-def plot_bar_kurang(counter, tajuk, filename, bottom=5):
-    if not counter:
+def plot_bar(counter, tajuk, top=5):
+    labels, values = data_bar(counter, top)
+    if not labels:
         return None
+    return render_bar(labels, values, tajuk)
 
-    data = [(k, v) for k, v in counter.items() if v > 0]
-    if not data:
+def plot_bar_kurang(counter, tajuk, bottom=5):
+    labels, values = data_bar_kurang(counter, bottom)
+    if not labels:
         return None
+    return render_bar(labels, values, tajuk)
 
-    data = sorted(data, key=lambda x: x[1])[:bottom]
 
-    labels = [d[0] for d in data]
-    values = [d[1] for d in data]
+def lukis_bar(counter, tajuk, top=5):
+    labels, values = data_bar(counter, top)
+    if not labels:
+        return None
+    return render_bar_vektor(labels, values, tajuk)
 
-    plt.figure(figsize=(8,4))
-    plt.bar(labels, values)
-    plt.title(tajuk)
-    plt.xticks(rotation=30, ha="right")
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
 
-    return filename
+def lukis_bar_kurang(counter, tajuk, bottom=5):
+    labels, values = data_bar_kurang(counter, bottom)
+    if not labels:
+        return None
+    return render_bar_vektor(labels, values, tajuk)
 
 
 
@@ -219,9 +1012,13 @@ def get_julat_ahad_khamis():
 
     return ahad, khamis
 
-def bina_pdf(gambar_list):
-    filename = f"Analisis_Relief_{date.today()}.pdf"
-    doc = SimpleDocTemplate(filename)
+def bina_pdf(gambar_list, guru_ganti, guru_list=GURU_LIST, nama_sekolah=NAMA_SEKOLAH,
+             moto=MOTO_SEKOLAH, tagar=TAGAR_SEKOLAH):
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer, KeepTogether
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf)
     styles = getSampleStyleSheet()
     story = []
 
@@ -246,8 +1043,7 @@ def bina_pdf(gambar_list):
     story.append(Spacer(1, 12))
 
     # === Senarai guru 0 kali mengganti (TEKS SAHAJA) ===
-    _, _, guru_ganti, _ = get_data_7_hari()
-    guru_0 = get_guru_tiada_ganti(GURU_LIST, guru_ganti)
+    guru_0 = get_guru_tiada_ganti(guru_list, guru_ganti)
 
     if guru_0:
         story.append(Paragraph(
@@ -265,28 +1061,36 @@ def bina_pdf(gambar_list):
 
         section.append(Paragraph(tajuk, styles["Heading2"]))
         section.append(Spacer(1, 6))
-        section.append(Image(img, width=400, height=200))
+        # PNG (matplotlib) atau Drawing reportlab (vektor, terus jadi flowable)
+        if isinstance(img, bytes):
+            img = Image(io.BytesIO(img), width=400, height=200)
+        section.append(img)
         section.append(Spacer(1, 20))
 
         story.append(KeepTogether(section))
 
+    hf = functools.partial(header_footer, nama_sekolah=nama_sekolah, moto=moto, tagar=tagar)
     doc.build(
     story,
-    onFirstPage=header_footer,
-    onLaterPages=header_footer
+    onFirstPage=hf,
+    onLaterPages=hf
     )
 
-    return filename
+    return buf.getvalue()
 # ==================================================
 # GRID KEYBOARD
 # ==================================================
-def grid_keyboard(items, callback_prefix, cols=2, emoji=None):
+# PATCH: callback_data guna indeks pendek ("gp|12") bukan nama penuh guru,
+# jadi jauh di bawah had 64 bait Telegram. Papan kekunci dibina sekali sahaja.
+# `indeks` (pilihan) ialah indeks asal setiap item jika senarai disusun semula.
+def grid_keyboard(items, callback_prefix, cols=2, emoji=None, indeks=None):
     keyboard = []
     row = []
 
-    for item in items:
+    for i, item in enumerate(items):
         text = f"{emoji} {item}" if emoji else item
-        row.append(InlineKeyboardButton(text, callback_data=f"{callback_prefix}|{item}"))
+        idx = indeks[i] if indeks is not None else i
+        row.append(InlineKeyboardButton(text, callback_data=f"{callback_prefix}|{idx}"))
 
         if len(row) == cols:
             keyboard.append(row)
@@ -298,6 +1102,10 @@ def grid_keyboard(items, callback_prefix, cols=2, emoji=None):
     return InlineKeyboardMarkup(keyboard)
 
 
+# Papan kekunci guru / kelas / subjek ikut sekolah: lihat Tenant.keyboard_*
+KEYBOARD_MASA = grid_keyboard(MASA_LIST, "m", cols=2)
+
+
 # ==================================================
 # UTIL TARIKH
 # ==================================================
@@ -329,205 +1137,1895 @@ def get_hari_bm(tarikh_iso):
 # ==================================================
 # PATCH: PILIH SHEET IKUT BULAN
 # ==================================================
-def get_sheet_by_month(tarikh_iso):
+BULAN_MAP = {
+    1: "Sheet1",
+    2: "Februari",
+    3: "MAC",
+    4: "APRIL",
+    5: "MEI",
+    6: "JUN",
+    7: "JULAI",
+    8: "OGOS",
+    9: "SEPTEMBER",
+    10: "OKTOBER",
+    11: "NOVEMBER",
+    12: "DISEMBER"
+}
+
+
+def nama_tab_bulan(tarikh_iso):
     dt = datetime.strptime(tarikh_iso, "%Y-%m-%d")
+    return BULAN_MAP[dt.month]
 
-    bulan_map = {
-        1: "Sheet1",
-        2: "Februari",
-        3: "MAC",
-        4: "APRIL",
-        5: "MEI",
-        6: "JUN",
-        7: "JULAI",
-        8: "OGOS",
-        9: "SEPTEMBER",
-        10: "OKTOBER",
-        11: "NOVEMBER",
-        12: "DISEMBER"
-    }
 
+def get_sheet_by_month(tarikh_iso):
     try:
-        return spreadsheet.worksheet(bulan_map[dt.month])
-    except:
-        return spreadsheet.sheet1
+        return get_sheets_client().worksheet(nama_tab_bulan(tarikh_iso))
+    except Exception as e:
+        # ralat kuota / rangkaian jangan jatuh ke Sheet1 (rekod masuk tab salah)
+        if boleh_cuba_semula(e):
+            raise
+        return get_sheets_client().sheet1
 
 
 # ==================================================
-# START
+# CACHE REKOD (READ-THROUGH, TTL + LRU)
 # ==================================================
-async def analisis_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("⏳ Menjana laporan analisis mingguan...")
+# Salinan tab bulan dalam memori supaya "Semak Rekod" & analisis
+# tidak memanggil get_all_values() setiap kali butang ditekan.
+RECORD_CACHE_TTL = int(os.environ.get("RECORD_CACHE_TTL", "300"))
+RECORD_CACHE_MAX_TABS = int(os.environ.get("RECORD_CACHE_MAX_TABS", "3"))
+
+
+class MonthTab:
+    # Tidak diubah selepas dibina: thread I/O mengulang rows/by_date tanpa
+    # kunci, jadi rekod baru menghasilkan MonthTab baharu (copy-on-write)
+    def __init__(self, rows, expires_at, by_date=None):
+        self.rows = rows
+        self.expires_at = expires_at
+        if by_date is not None:
+            self.by_date = by_date
+            return
+        self.by_date = {}
+        for r in rows:
+            if len(r) > 1:
+                self.by_date.setdefault(r[1], []).append(r)
+
+
+class RecordStore:
+    def __init__(self, ttl=RECORD_CACHE_TTL, max_tabs=RECORD_CACHE_MAX_TABS):
+        self.ttl = ttl
+        self.max_tabs = max_tabs
+        self._tabs = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def _get_cached(self, nama_tab):
+        with self._lock:
+            tab = self._tabs.get(nama_tab)
+            if tab is None:
+                return None
+            if tab.expires_at <= time.monotonic():
+                del self._tabs[nama_tab]
+                return None
+            self._tabs.move_to_end(nama_tab)
+            return tab
+
+    def _put(self, nama_tab, tab):
+        with self._lock:
+            self._tabs[nama_tab] = tab
+            self._tabs.move_to_end(nama_tab)
+            while len(self._tabs) > self.max_tabs:
+                self._tabs.popitem(last=False)
+
+    def peek_tab(self, tarikh_iso):
+        return self._get_cached(nama_tab_bulan(tarikh_iso))
+
+    def get_tab(self, tarikh_iso):
+        nama_tab = nama_tab_bulan(tarikh_iso)
+        tab = self._get_cached(nama_tab)
+        if tab is not None:
+            return tab
+
+        # PATCH: bacaan serentak untuk tab yang sama kongsi satu get_all_values()
+        return self._flight.do(nama_tab, lambda: self._muat(tarikh_iso, nama_tab))
+
+    def _muat(self, tarikh_iso, nama_tab):
+        rows = get_sheet_by_month(tarikh_iso).get_all_values()
+        data = rows[1:] if len(rows) > 1 else []
+        tab = MonthTab(data, time.monotonic() + self.ttl)
+        self._put(nama_tab, tab)
+        return tab
 
-    kelas, subjek, guru_ganti, guru_diganti = get_data_7_hari()
+    def rows_for_date(self, tarikh_iso):
+        return self.get_tab(tarikh_iso).by_date.get(tarikh_iso, [])
 
-    if not kelas:
-        await update.message.reply_text("Tiada data relief untuk 7 hari terakhir.")
-        return
+    def record_written(self, tarikh_iso, row):
+        # Rekod baru dimasukkan di ROW 2, jadi letak di depan salinan cache
+        nama_tab = nama_tab_bulan(tarikh_iso)
+        with self._lock:
+            tab = self._tabs.get(nama_tab)
+            if tab is None:
+                return
+            by_date = dict(tab.by_date)
+            by_date[row[1]] = [row] + by_date.get(row[1], [])
+            self._tabs[nama_tab] = MonthTab([row] + tab.rows, tab.expires_at, by_date)
 
-    files = []
-    files.append(("🏫 Kelas Paling Banyak Diganti", plot_bar(kelas, "Kelas Diganti", "kelas.png")))
-    files.append(("📚 Subjek Paling Banyak Diganti", plot_bar(subjek, "Subjek Diganti", "subjek.png")))
-    files.append(("👨‍🏫 Guru Paling Banyak Mengganti", plot_bar(guru_ganti, "Guru Mengganti", "guru_ganti.png")))
-    files.append(("👤 Guru Paling Banyak Diganti", plot_bar(guru_diganti, "Guru Diganti", "guru_diganti.png")))
-    files.append(("👨‍🏫 Guru Paling Kurang Mengganti",
-    plot_bar_kurang(guru_ganti, "Guru Paling Kurang Mengganti", "guru_kurang.png", bottom=5)))
+    def invalidate(self, tarikh_iso=None):
+        with self._lock:
+            if tarikh_iso is None:
+                self._tabs.clear()
+            else:
+                self._tabs.pop(nama_tab_bulan(tarikh_iso), None)
 
 
-    files = [f for f in files if f[1]]
+record_store = TenantLocal("record_store", RecordStore)
 
-    pdf = bina_pdf(files)
 
-    await update.message.reply_document(
-        document=open(pdf, "rb"),
-        caption="📊 Laporan Analisis Relief Mingguan"
-    )
+# ==================================================
+# ASYNC I/O (GSPREAD / FIREBASE DI LUAR EVENT LOOP)
+# ==================================================
+# Semua panggilan rangkaian yang "blocking" dijalankan dalam thread pool
+# supaya bot masih boleh melayan guru lain semasa muat naik / baca sheet.
+IO_MAX_WORKERS = int(os.environ.get("IO_MAX_WORKERS", "8"))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix="relief-io")
+
+
+class AsyncBackend:
+    def __init__(self, name, limit, timeout):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # tenant semasa (contextvars) turut dibawa ke thread I/O
+        ctx = contextvars.copy_context()
+        with metrics.timer("backend", self.name):
+            async with self._semaphore:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(io_executor, functools.partial(ctx.run, func, *args, **kwargs)),
+                    self.timeout
+                )
+
+    async def run_habis(self, func, *args, **kwargs):
+        # Untuk penulisan ikut kedudukan baris di bawah kunci_tulis(): tanpa
+        # wait_for, kerana timeout hanya meninggalkan future & thread terus
+        # menulis selepas kunci dilepaskan. Tempoh dihadkan oleh
+        # SHEETS_WRITE_BUDGET & SHEETS_HTTP_TIMEOUT dalam panggil_sheets.
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        with metrics.timer("backend", self.name):
+            async with self._semaphore:
+                return await loop.run_in_executor(
+                    io_executor, functools.partial(ctx.run, func, *args, **kwargs)
+                )
+
+
+sheets_io = AsyncBackend(
+    "sheets",
+    int(os.environ.get("SHEETS_CONCURRENCY", "4")),
+    float(os.environ.get("SHEETS_TIMEOUT", "90"))
+)
+storage_io = AsyncBackend(
+    "storage",
+    int(os.environ.get("STORAGE_CONCURRENCY", "4")),
+    float(os.environ.get("STORAGE_TIMEOUT", "60"))
+)
+# reportlab guna CPU, jadi PDF dibina satu demi satu
+report_io = AsyncBackend("report", 1, float(os.environ.get("REPORT_TIMEOUT", "120")))
 
-    # cleanup
-    for _, f in files:
-        os.remove(f)
-    os.remove(pdf)
 
+tab_flight = AsyncSingleFlight()
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
 
-    reply_keyboard = [
-    [KeyboardButton("🟢 Hari Ini"), KeyboardButton("📅 Tarikh Lain")],
-    [KeyboardButton("📊 Semak Rekod Hari Ini"), KeyboardButton("📈 Analisis Mingguan (PDF)")],
-    [KeyboardButton("📊 Lihat Rekod Penuh (Admin)")]
-]
+async def baca_rekod_tarikh(tarikh_iso):
+    tab = record_store.peek_tab(tarikh_iso)
+    if tab is None:
+        # pemanggil serentak tunggu task yang sama, tanpa ambil slot thread
+        tab = await tab_flight.do(
+            (tenant_semasa().kunci, nama_tab_bulan(tarikh_iso)),
+            lambda: sheets_io.run(record_store.get_tab, tarikh_iso)
+        )
+    rows = tab.by_date.get(tarikh_iso, [])
+    # tarikh lama mungkin sudah dipindahkan ke arkib tahunan
+    if tenant_semasa().arkib and tarikh_iso < had_arkib():
+        rows = rows + await sheets_io.run(arkib_store.rows_for_date, tarikh_iso)
+    return rows
 
 
-    await update.message.reply_text(
-        "🤖 *Relief Check-In Tracker*\n\nPilih tindakan:",
-        reply_markup=ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True),
-        parse_mode="Markdown"
-    )
+# ==================================================
+# ROLLUP HARIAN (ANALISIS MINGGUAN)
+# ==================================================
+# Counter kelas / subjek / guru ganti / guru diganti disimpan ikut hari.
+# Dikemas kini setiap kali rekod ditulis & diselaraskan semula secara berkala.
+ROLLUP_RECONCILE_INTERVAL = float(os.environ.get("ROLLUP_RECONCILE_INTERVAL", "900"))
+
+
+class DayBucket:
+    def __init__(self):
+        self.kelas = Counter()
+        self.subjek = Counter()
+        self.guru_ganti = Counter()
+        self.guru_diganti = Counter()
+        self.bilangan = 0
+
+    def tambah(self, r):
+        if len(r) < 7:
+            return
+        self.bilangan += 1
+        self.kelas[r[5]] += 1
+        self.subjek[r[6]] += 1
+        self.guru_ganti[r[3]] += 1
+        self.guru_diganti[r[4]] += 1
+
+
+class RollupStore:
+    def __init__(self):
+        self._days = {}
+        self._tabs = set()
+        self._lock = threading.Lock()
+
+    def _bina_dari_tab(self, nama_tab, tab):
+        buckets = {}
+        for tarikh_iso, rows in tab.by_date.items():
+            hari = DayBucket()
+            for r in rows:
+                hari.tambah(r)
+            buckets[tarikh_iso] = hari
+
+        with self._lock:
+            for tarikh_iso in [t for t in self._days if self._tab_of(t) == nama_tab]:
+                del self._days[tarikh_iso]
+            self._days.update(buckets)
+            self._tabs.add(nama_tab)
+
+    @staticmethod
+    def _tab_of(tarikh_iso):
+        try:
+            return nama_tab_bulan(tarikh_iso)
+        except ValueError:
+            return None
+
+    def ensure(self, tarikh_iso):
+        nama_tab = nama_tab_bulan(tarikh_iso)
+        with self._lock:
+            if nama_tab in self._tabs:
+                return
+        self._bina_dari_tab(nama_tab, record_store.get_tab(tarikh_iso))
+
+    def record_written(self, tarikh_iso, row):
+        nama_tab = nama_tab_bulan(tarikh_iso)
+        with self._lock:
+            if nama_tab not in self._tabs:
+                return
+            self._days.setdefault(tarikh_iso, DayBucket()).tambah(row)
+
+    def jumlah(self, tarikh_list):
+        for tarikh_iso in tarikh_list:
+            self.ensure(tarikh_iso)
+
+        kelas = Counter()
+        subjek = Counter()
+        guru_ganti = Counter()
+        guru_diganti = Counter()
+
+        with self._lock:
+            for tarikh_iso in tarikh_list:
+                hari = self._days.get(tarikh_iso)
+                if hari is None:
+                    continue
+                kelas.update(hari.kelas)
+                subjek.update(hari.subjek)
+                guru_ganti.update(hari.guru_ganti)
+                guru_diganti.update(hari.guru_diganti)
+
+        return kelas, subjek, guru_ganti, guru_diganti
+
+    def versi(self, tarikh_list):
+        # "versi data" untuk cache laporan: bilangan rekod setiap hari
+        for tarikh_iso in tarikh_list:
+            self.ensure(tarikh_iso)
+        with self._lock:
+            return tuple(
+                self._days[t].bilangan if t in self._days else 0
+                for t in tarikh_list
+            )
+
+    def reconcile(self, tarikh_list):
+        # Baca semula tab dari Sheets supaya suntingan manual turut dikira
+        for nama_tab, tarikh_iso in {nama_tab_bulan(t): t for t in tarikh_list}.items():
+            record_store.invalidate(tarikh_iso)
+            self._bina_dari_tab(nama_tab, record_store.get_tab(tarikh_iso))
+
+
+rollup_store = TenantLocal("rollup_store", RollupStore)
+
+
+async def reconcile_loop():
+    while True:
+        await asyncio.sleep(ROLLUP_RECONCILE_INTERVAL)
+        # hanya sekolah yang sedang dibuka; yang lain dibina semula bila perlu
+        for tenant in tenant_pool.terbuka():
+            # jangan baca semula semasa masih ada rekod belum di-flush
+            if journal.count(tenant.kunci):
+                continue
+            with guna_tenant(tenant):
+                try:
+                    await sheets_io.run(rollup_store.reconcile, senarai_7_hari())
+                    await sheets_io.run(conflict_index.bina_semula, senarai_7_hari())
+                    await sheets_io.run(load_index.bina_semula, senarai_7_hari())
+                except Exception as e:
+                    print("RECONCILE ERROR:", tenant.kunci, e)
 
 
 # ==================================================
-# SEMAK REKOD HARI INI
+# INDEKS KONFLIK (REKOD BERGANDA)
 # ==================================================
-async def semak_rekod(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    today_iso = datetime.now().strftime("%Y-%m-%d")
-    today_display = datetime.now().strftime("%d/%m/%Y")
+# (tarikh, masa, kelas) dan (tarikh, masa, guru pengganti) -> rekod sedia ada.
+# Dibina sekali bagi setiap tab bulan (melalui cache rekod), kemudian
+# dikemas kini setiap kali rekod baru disimpan. Semakan semasa guru
+# menekan butang hanyalah carian dict.
+class ConflictIndex:
+    # Indeks disimpan ikut tab: bina semula satu tab berlaku di luar kunci
+    # (event loop turut guna kunci ini) & hanya pertukaran rujukan dikunci
+    def __init__(self):
+        self._kelas = {}
+        self._guru = {}
+        self._tabs = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _tambah(kelas, guru, r):
+        if len(r) < 6:
+            return
+        kelas.setdefault((r[1], r[2], r[5]), r)
+        guru.setdefault((r[1], r[2], r[3]), r)
+
+    def _bina_dari_tab(self, nama_tab, tab):
+        kelas, guru = {}, {}
+        for r in tab.rows:
+            self._tambah(kelas, guru, r)
+        with self._lock:
+            self._kelas[nama_tab] = kelas
+            self._guru[nama_tab] = guru
+            self._tabs.add(nama_tab)
+
+    def sedia(self, tarikh_iso):
+        with self._lock:
+            return nama_tab_bulan(tarikh_iso) in self._tabs
+
+    def ensure(self, tarikh_iso):
+        if self.sedia(tarikh_iso):
+            return
+        self._bina_dari_tab(nama_tab_bulan(tarikh_iso), rekod_bulan(tarikh_iso))
 
-    # PATCH: baca tab ikut bulan semasa
-    today_sheet = get_sheet_by_month(today_iso)
+    def bina_semula(self, tarikh_list):
+        for nama_tab, tarikh_iso in {nama_tab_bulan(t): t for t in tarikh_list}.items():
+            self._bina_dari_tab(nama_tab, rekod_bulan(tarikh_iso))
 
-    rows = today_sheet.get_all_values()
-    data_rows = rows[1:] if len(rows) > 1 else []
+    def record_written(self, tarikh_iso, row):
+        nama_tab = nama_tab_bulan(tarikh_iso)
+        with self._lock:
+            if nama_tab in self._tabs:
+                self._tambah(self._kelas[nama_tab], self._guru[nama_tab], row)
 
-    rekod = [r for r in data_rows if len(r) > 1 and r[1] == today_iso]
+    def konflik_kelas(self, tarikh_iso, masa, kelas):
+        with self._lock:
+            return self._kelas.get(nama_tab_bulan(tarikh_iso), {}).get((tarikh_iso, masa, kelas))
 
-    if not rekod:
-        await update.message.reply_text(
-            f"📊 *Rekod Relief Hari Ini*\n📅 {today_display}\n\nTiada rekod direkodkan.",
-            parse_mode="Markdown"
-        )
-        return
+    def konflik_guru(self, tarikh_iso, masa, guru):
+        with self._lock:
+            return self._guru.get(nama_tab_bulan(tarikh_iso), {}).get((tarikh_iso, masa, guru))
 
-    mesej = f"📊 *REKOD RELIEF HARI INI*\n📅 {today_display}\n\n"
 
-    for i, r in enumerate(rekod, start=1):
-        mesej += (
-            f"{i}️⃣ {r[2]}\n"
-            f"👨‍🏫 Pengganti: {r[3]}\n"
-            f"👤 Diganti: {r[4]}\n"
-            f"🏫 {r[5]}\n"
-            f"📚 {r[6]}\n\n"
-        )
+conflict_index = TenantLocal("conflict_index", ConflictIndex)
 
-    await update.message.reply_text(mesej, parse_mode="Markdown")
+
+async def semak_konflik(tarikh_iso, semak):
+    # Indeks tab dibina sekali (biasanya dari cache); selepas itu O(1)
+    if not tarikh_iso:
+        return None
+    if not conflict_index.sedia(tarikh_iso):
+        try:
+            await sheets_io.run(conflict_index.ensure, tarikh_iso)
+        except Exception as e:
+            print("CONFLICT INDEX ERROR:", e)
+            return None
+    return semak()
 
 
 # ==================================================
-# ADMIN LOCK
+# PENGESYOR GURU PENGGANTI (BEBAN MINGGU & PENGGAL)
 # ==================================================
-async def lihat_penuh(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMIN_IDS:
-        await update.message.reply_text(
-            "⛔ *Akses Terhad*\n\nHanya pentadbir boleh melihat rekod penuh.",
-            parse_mode="Markdown"
+# Kaunter beban setiap guru (minggu Ahad-Khamis & penggal semasa) serta
+# guru yang sibuk bagi setiap (tarikh, masa) dibina sekali dari tab bulan,
+# kemudian dikemas kini setiap kali rekod disimpan. Papan kekunci guru
+# pengganti disusun dari kaunter ini sahaja, tanpa membaca Sheets.
+# PENGGAL_MULA: tarikh mula setiap penggal, cth. "2026-01-12,2026-06-08".
+# Tanpanya, "penggal" = suku tahun kalendar, supaya paling banyak 3 tab
+# dibaca semasa kaunter dibina (bukan semua tab sejak Januari).
+PENGGAL_MULA = [t.strip() for t in os.environ.get("PENGGAL_MULA", "").split(",") if t.strip()]
+
+
+def mula_minggu(tarikh_obj):
+    # minggu persekolahan bermula Ahad
+    return tarikh_obj - timedelta(days=(tarikh_obj.weekday() + 1) % 7)
+
+
+def mula_penggal(tarikh_obj):
+    mula = [m for m in PENGGAL_MULA if m <= tarikh_obj.isoformat()]
+    if mula:
+        return date.fromisoformat(max(mula))
+    return date(tarikh_obj.year, 3 * ((tarikh_obj.month - 1) // 3) + 1, 1)
+
+
+class LoadIndex:
+    # Kaunter & slot sibuk setiap tab dibina di luar kunci (tarikh diparse
+    # bagi setiap baris) dan hanya ditukar masuk di bawah kunci, seperti
+    # RollupStore: event loop guna kunci yang sama dalam sedia/cadangan.
+    def __init__(self):
+        self._beban = Counter()
+        self._per_tab = {}
+        self._sibuk = {}
+        self._tabs = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _kunci(tarikh_obj):
+        return (
+            ("minggu", mula_minggu(tarikh_obj).isoformat()),
+            ("penggal", mula_penggal(tarikh_obj).isoformat()),
         )
-        return
 
-    await update.message.reply_text("📊 *Rekod Relief Penuh:*", parse_mode="Markdown")
-    await update.message.reply_text(SHEET_URL)
+    @classmethod
+    def _kira(cls, beban, sibuk, r):
+        if len(r) < 5:
+            return
+        try:
+            kunci = cls._kunci(date.fromisoformat(r[1]))
+        except ValueError:
+            return
+        for k in kunci:
+            beban[(k, r[3])] += 1
+        # pengganti sudah bertugas & guru diganti tiada pada slot itu
+        sibuk.setdefault((r[1], r[2]), set()).update((r[3], r[4]))
+
+    def _bina_dari_tab(self, nama_tab, rows):
+        beban, sibuk = Counter(), {}
+        for r in rows:
+            self._kira(beban, sibuk, r)
+        with self._lock:
+            self._beban.subtract(self._per_tab.get(nama_tab, Counter()))
+            self._beban.update(beban)
+            self._beban = +self._beban
+            self._per_tab[nama_tab] = beban
+            self._sibuk[nama_tab] = sibuk
+            self._tabs.add(nama_tab)
+
+    @staticmethod
+    def tab_diperlukan(tarikh_iso):
+        # semua tab bulan dari awal penggal hingga bulan tarikh_iso
+        tarikh_obj = date.fromisoformat(tarikh_iso)
+        bulan = mula_penggal(tarikh_obj).replace(day=1)
+        tabs = {}
+        while bulan <= tarikh_obj and len(tabs) < 12:
+            t = bulan.strftime("%Y-%m-%d")
+            tabs[nama_tab_bulan(t)] = t
+            bulan = (bulan + timedelta(days=32)).replace(day=1)
+        return tabs
+
+    def sedia(self, tarikh_iso):
+        with self._lock:
+            return all(nama in self._tabs for nama in self.tab_diperlukan(tarikh_iso))
+
+    def ensure(self, tarikh_iso):
+        with self._lock:
+            perlu = {n: t for n, t in self.tab_diperlukan(tarikh_iso).items() if n not in self._tabs}
+        if not perlu:
+            return
+        for nama_tab, rows in rekod_ringkas(perlu).items():
+            self._bina_dari_tab(nama_tab, rows)
+
+    def bina_semula(self, tarikh_list):
+        for nama_tab, tarikh_iso in {nama_tab_bulan(t): t for t in tarikh_list}.items():
+            self._bina_dari_tab(nama_tab, rekod_bulan(tarikh_iso).rows)
+
+    def record_written(self, tarikh_iso, row):
+        nama_tab = nama_tab_bulan(tarikh_iso)
+        with self._lock:
+            if nama_tab not in self._tabs:
+                return
+            beban = Counter()
+            self._kira(beban, self._sibuk[nama_tab], row)
+            self._per_tab[nama_tab].update(beban)
+            self._beban.update(beban)
+
+    def cadangan(self, tarikh_iso, masa):
+        # (beban minggu, beban penggal, indeks senarai guru, nama), paling kurang dahulu
+        minggu, penggal = self._kunci(date.fromisoformat(tarikh_iso))
+        guru = tenant_semasa().guru
+        with self._lock:
+            sibuk = self._sibuk.get(nama_tab_bulan(tarikh_iso), {}).get((tarikh_iso, masa), set())
+            calon = [
+                (self._beban[(minggu, g)], self._beban[(penggal, g)], i, g)
+                for i, g in enumerate(guru)
+                if g not in sibuk
+            ]
+        calon.sort()
+        return calon
+
+
+load_index = TenantLocal("load_index", LoadIndex)
+
+
+async def keyboard_pengganti(tarikh_iso, masa):
+    # Jika kaunter belum sedia / gagal dibina, guna senarai penuh asal
+    if not tarikh_iso:
+        return tenant_semasa().keyboard_guru_pengganti
+    try:
+        if not load_index.sedia(tarikh_iso):
+            await sheets_io.run(load_index.ensure, tarikh_iso)
+        calon = load_index.cadangan(tarikh_iso, masa)
+    except Exception as e:
+        print("LOAD INDEX ERROR:", e)
+        return tenant_semasa().keyboard_guru_pengganti
+    if not calon:
+        return tenant_semasa().keyboard_guru_pengganti
+
+    return grid_keyboard(
+        [f"{g} ({m}/{p})" for m, p, _, g in calon],
+        "gp",
+        cols=3,
+        emoji="🟢",
+        indeks=[i for _, _, i, _ in calon]
+    )
 
 
 # ==================================================
-# HARI INI
+# STORAN KEKAL (JOURNAL & STATE SQLITE)
 # ==================================================
-async def hari_ini(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        await update.message.delete()
-    except:
-        pass
-
-    context.user_data["tarikh"] = datetime.now().strftime("%Y-%m-%d")
+# Guru diberitahu "berjaya" sebaik rekod masuk journal, dan aliran check-in
+# disambung dari fail state, jadi kedua-dua fail MESTI berada pada storan
+# yang kekal selepas restart/deploy (volume atau disk pelayan). Tetapkan
+# DATA_DIR (atau JOURNAL_PATH / STATE_PATH) ke storan itu; tanpanya, bot
+# enggan bermula. Sistem fail dyno (DYNO ditetapkan)
+# dibuang pada setiap restart, deploy & kitaran harian: di situ DATA_DIR
+# mesti satu mount point (cth. storage mount Dokku). Heroku tiada volume,
+# jadi bot enggan bermula pada dyno Heroku.
+DATA_DIR = os.environ.get("DATA_DIR", "")
+
+
+def laluan_data(env, nama_fail):
+    return os.environ.get(env) or os.path.join(DATA_DIR, nama_fail)
+
+
+def pastikan_storan_kekal(**laluan):
+    # laluan: {"JOURNAL_PATH": "..."}; dipanggil dalam main() sebelum bot mula
+    if "DYNO" in os.environ and not (DATA_DIR and os.path.ismount(DATA_DIR)):
+        raise RuntimeError(
+            "Sistem fail dyno tidak kekal: journal & state aliran hilang bila dyno restart. "
+            "Tetapkan DATA_DIR ke volume yang di-mount (Heroku tiada volume: guna pelayan dengan disk kekal)."
+        )
+    for env, path in laluan.items():
+        if not (os.environ.get(env) or DATA_DIR):
+            raise RuntimeError(f"Tetapkan DATA_DIR atau {env} ke storan yang kekal selepas restart")
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.access(folder, os.W_OK):
+            raise RuntimeError(f"{env}: folder {folder} tidak wujud atau tidak boleh ditulis")
 
-    keyboard = grid_keyboard(MASA_LIST, "masa", cols=2)
 
-    msg = await update.effective_chat.send_message(
-        "📅 Tarikh: *Hari Ini*\n\n⏰ Pilih masa:",
-        reply_markup=keyboard,
-        parse_mode="Markdown"
+# ==================================================
+# WRITE-BEHIND JOURNAL (SQLITE)
+# ==================================================
+# gambar() hanya simpan rekod dalam journal tempatan & terus balas guru.
+# Flusher di latar belakang tulis semua rekod tertunda ikut tab bulan
+# dalam SATU batch_update (insert baris + formula =IMAGE sekali gus).
+# Kumpulan (tenant, tab) yang gagal menunggu dengan backoff tanpa menahan
+# kumpulan lain. Batch yang gagal ditanda "ragu" (mungkin sudah sampai ke
+# Google): cubaan seterusnya menyemak seluruh batch di atas tab dahulu.
+# Jika belum ditulis, baris dicuba satu demi satu dan baris yang masih
+# gagal selepas FLUSH_MAX_ATTEMPTS dipindah ke jadual dead_rows.
+JOURNAL_PATH = laluan_data("JOURNAL_PATH", "relief_journal.db")
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", "3"))
+FLUSH_BATCH_SIZE = int(os.environ.get("FLUSH_BATCH_SIZE", "50"))
+FLUSH_MAX_ATTEMPTS = int(os.environ.get("FLUSH_MAX_ATTEMPTS", "8"))
+FLUSH_BACKOFF_BASE = float(os.environ.get("FLUSH_BACKOFF_BASE", "5"))
+FLUSH_BACKOFF_MAX = float(os.environ.get("FLUSH_BACKOFF_MAX", "600"))
+
+
+def tenant_migrasi():
+    # pemilik rekod journal lama: TENANT_DEFAULT, atau satu-satunya tenant
+    lalai = tenant_pool.lalai()
+    if lalai is not None:
+        return lalai.kunci
+    semua = tenant_pool.semua()
+    if len(semua) == 1:
+        return semua[0].kunci
+    raise RuntimeError(
+        f"{JOURNAL_PATH} ada rekod tertunda tanpa tenant: tetapkan TENANT_DEFAULT untuk memilih pemiliknya"
     )
 
-    context.user_data["last_message_id"] = msg.message_id
+
+class WriteJournal:
+    def __init__(self, path=JOURNAL_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_rows ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " tab TEXT NOT NULL,"
+            " tarikh TEXT NOT NULL,"
+            " row_json TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_rows ("
+            " id INTEGER PRIMARY KEY,"
+            " tenant TEXT NOT NULL,"
+            " tab TEXT NOT NULL,"
+            " tarikh TEXT NOT NULL,"
+            " row_json TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " ralat TEXT NOT NULL,"
+            " dead_at REAL NOT NULL)"
+        )
+        # journal lama (sebelum berbilang sekolah): rekod ditanda "default",
+        # kemudian diserah kepada tenant lalai jika "default" tiada dalam pool
+        lajur = [r[1] for r in self._conn.execute("PRAGMA table_info(pending_rows)")]
+        if "tenant" not in lajur:
+            self._conn.execute("ALTER TABLE pending_rows ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'")
+        if tenant_pool.dapatkan("default") is None and self._conn.execute(
+            "SELECT 1 FROM pending_rows WHERE tenant = 'default' LIMIT 1"
+        ).fetchone():
+            self._conn.execute(
+                "UPDATE pending_rows SET tenant = ? WHERE tenant = 'default'", (tenant_migrasi(),)
+            )
+        if "next_attempt" not in lajur:
+            self._conn.execute("ALTER TABLE pending_rows ADD COLUMN next_attempt REAL NOT NULL DEFAULT 0")
+        if "ragu" not in lajur:
+            # id baris tertua batch yang gagal tanpa kepastian; NULL = belum dihantar
+            self._conn.execute("ALTER TABLE pending_rows ADD COLUMN ragu INTEGER")
+        self._conn.commit()
+
+    def enqueue(self, tarikh_iso, row):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO pending_rows (tenant, tab, tarikh, row_json, created_at) VALUES (?, ?, ?, ?, ?)",
+                (tenant_semasa().kunci, nama_tab_bulan(tarikh_iso), tarikh_iso,
+                 json.dumps(row, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+            return cur.lastrowid
+
+    def pending(self, limit=FLUSH_BATCH_SIZE):
+        # Setiap kumpulan (tenant, tab) dipilih berasingan: kumpulan yang
+        # sedang backoff tidak menghalang kumpulan lain. Baris tertua kumpulan
+        # menentukan giliran supaya susunan baris dalam sheet kekal.
+        now = time.time()
+        hasil = []
+        with self._lock:
+            kumpulan = self._conn.execute(
+                "SELECT p.tenant, p.tab, p.attempts, p.next_attempt, p.ragu FROM pending_rows p"
+                " JOIN (SELECT MIN(id) AS id FROM pending_rows GROUP BY tenant, tab) k ON p.id = k.id"
+                " ORDER BY p.id"
+            ).fetchall()
+            for tenant, tab, attempts, next_attempt, ragu in kumpulan:
+                if next_attempt > now:
+                    continue
+                if ragu is not None:
+                    # batch yang gagal tadi, dipulangkan utuh untuk disemak
+                    cur = self._conn.execute(
+                        "SELECT id, tarikh, row_json, ragu FROM pending_rows WHERE ragu = ? ORDER BY id",
+                        (ragu,)
+                    )
+                else:
+                    # pernah gagal: cuba baris tertua seorang diri, supaya satu
+                    # baris rosak tidak menyeret baris lain ke dead_rows
+                    cur = self._conn.execute(
+                        "SELECT id, tarikh, row_json, ragu FROM pending_rows WHERE tenant = ? AND tab = ?"
+                        " ORDER BY id LIMIT ?",
+                        (tenant, tab, 1 if attempts else limit)
+                    )
+                hasil.extend(
+                    (i, tenant, tab, tarikh, json.loads(row_json), r)
+                    for i, tarikh, row_json, r in cur.fetchall()
+                )
+        return hasil
+
+    def ack(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM pending_rows WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def mark_failed(self, ids, ralat=""):
+        # Seluruh batch ditanda ragu; hanya baris tertua (penentu giliran
+        # kumpulan) dikira gagal. Pulangkan bilangan baris ke dead_rows.
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE pending_rows SET ragu = ? WHERE id = ?", [(ids[0], i) for i in ids]
+            )
+            self._conn.execute(
+                "UPDATE pending_rows SET attempts = attempts + 1,"
+                " next_attempt = ? + MIN(?, ? * (1 << MIN(attempts, 20))) WHERE id = ?",
+                (now, FLUSH_BACKOFF_MAX, FLUSH_BACKOFF_BASE, ids[0])
+            )
+            mati = 0
+            # batch berbilang baris sentiasa disemak & dipecah dahulu
+            if len(ids) == 1:
+                mati = self._ke_dead_rows(ids, ralat, now, FLUSH_MAX_ATTEMPTS)
+            self._conn.commit()
+            return mati
+
+    def buang(self, ids, ralat):
+        # tidak akan berjaya (cth. tenant tiada): terus ke dead_rows
+        with self._lock:
+            mati = self._ke_dead_rows(ids, ralat, time.time(), 0)
+            self._conn.commit()
+            return mati
+
+    def jelas(self, ids):
+        # batch ragu disahkan belum ditulis
+        with self._lock:
+            self._conn.executemany("UPDATE pending_rows SET ragu = NULL WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def _ke_dead_rows(self, ids, ralat, now, had):
+        mati = 0
+        for i in ids:
+            cur = self._conn.execute(
+                "INSERT INTO dead_rows (id, tenant, tab, tarikh, row_json, created_at, attempts, ralat, dead_at)"
+                " SELECT id, tenant, tab, tarikh, row_json, created_at, attempts, ?, ?"
+                " FROM pending_rows WHERE id = ? AND attempts >= ?",
+                (str(ralat), now, i, had)
+            )
+            if cur.rowcount:
+                self._conn.execute("DELETE FROM pending_rows WHERE id = ?", (i,))
+                mati += cur.rowcount
+        return mati
+
+    def count(self, tenant=None):
+        with self._lock:
+            if tenant is None:
+                return self._conn.execute("SELECT COUNT(*) FROM pending_rows").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM pending_rows WHERE tenant = ?", (tenant,)
+            ).fetchone()[0]
+
+
+def sel_teks(nilai):
+    return {"userEnteredValue": {"stringValue": str(nilai)}}
+
+
+def sel_formula(formula):
+    return {"userEnteredValue": {"formulaValue": formula}}
+
+
+def formula_gambar(row, idx_thumb, idx_asal):
+    # Guna thumbnail jika ada; jika tidak, papar gambar asal (kolum H/I)
+    thumb = row[idx_thumb] if len(row) > idx_thumb else ""
+    return formula_image(thumb or row[idx_asal])
+
+
+def sudah_ditulis(tarikh_iso, rows):
+    # Batch lepas gagal tanpa jawapan (timeout): mungkin Google sudah
+    # memasukkan SEMUA barisnya (satu batch_update). Flush di-serialkan per
+    # tab, jadi jika ia berjaya, batch itu masih berada di atas sekali.
+    terbaru_dahulu = list(reversed(rows))
+    atas = get_sheet_by_month(tarikh_iso).get_values(f"A2:I{1 + len(terbaru_dahulu)}")
+
+    def ratakan(row):
+        row = [str(v) for v in row[:9]]
+        return row + [""] * (9 - len(row))
+
+    return [ratakan(r) for r in atas] == [ratakan(r) for r in terbaru_dahulu]
+
+
+def tulis_batch(tarikh_iso, rows):
+    # rows: paling lama dahulu -> yang terbaru mesti berada di ROW 2
+    sheet = get_sheet_by_month(tarikh_iso)
+    terbaru_dahulu = list(reversed(rows))
+
+    data_rows = []
+    for row in terbaru_dahulu:
+        values = [sel_teks(v) for v in row[:9]]
+        values.append(sel_formula(formula_gambar(row, 9, 7)))
+        values.append(sel_formula(formula_gambar(row, 10, 8)))
+        data_rows.append({"values": values})
+
+    body = {"requests": [
+        {
+            "insertDimension": {
+                "range": {
+                    "sheetId": sheet.id,
+                    "dimension": "ROWS",
+                    "startIndex": 1,
+                    "endIndex": 1 + len(rows)
+                },
+                "inheritFromBefore": False
+            }
+        },
+        {
+            "updateCells": {
+                "start": {"sheetId": sheet.id, "rowIndex": 1, "columnIndex": 0},
+                "rows": data_rows,
+                "fields": "userEnteredValue"
+            }
+        }
+    ]}
+
+    get_sheets_client().batch_update(body)
+
+
+class WriteBehindFlusher:
+    def __init__(self, journal, interval=FLUSH_INTERVAL):
+        self.journal = journal
+        self.interval = interval
+        self._wake = asyncio.Event()
+        self._task = None
+        # flush() juga dipanggil terus (eksport, shutdown): satu sahaja pada
+        # satu masa supaya rekod tertunda tidak ditulis dua kali
+        self._flush_lock = asyncio.Lock()
+
+    def notify(self):
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        pending = self.journal.pending()
+        if not pending:
+            return
+
+        kumpulan = OrderedDict()
+        for i, tenant, tab, tarikh, row, ragu in pending:
+            kumpulan.setdefault((tenant, tab), []).append((i, tarikh, row, ragu))
+
+        for (kunci, tab), items in kumpulan.items():
+            ids = [i for i, _, _, _ in items]
+            rows = [row for _, _, row, _ in items]
+            tenant = tenant_pool.dapatkan(kunci)
+            if tenant is None:
+                # sekolah sudah dibuang daripada TENANTS_JSON: tidak akan berjaya
+                mati = self.journal.buang(ids, f"tenant tiada: {kunci}")
+                print(f"FLUSH ERROR: tenant tiada: {kunci} ({mati} rekod ke dead_rows)")
+                continue
+            with guna_tenant(tenant):
+                async with kunci_tulis():
+                    try:
+                        if items[0][3] is not None:
+                            if await sheets_io.run_habis(sudah_ditulis, items[0][1], rows):
+                                self.journal.ack(ids)
+                                continue
+                            # belum sampai ke Google: cuba baris tertua seorang diri
+                            self.journal.jelas(ids)
+                            ids, rows = ids[:1], rows[:1]
+                        await sheets_io.run_habis(tulis_batch, items[0][1], rows)
+                    except Exception as e:
+                        mati = self.journal.mark_failed(ids, e)
+                        print("FLUSH ERROR:", kunci, tab, e)
+                        if mati:
+                            print(f"FLUSH DEAD: {mati} rekod {kunci}/{tab} dipindah ke dead_rows")
+                        continue
+                    self.journal.ack(ids)
+
+
+journal = WriteJournal()
+flusher = WriteBehindFlusher(journal)
+
+# Penulisan yang bergantung pada kedudukan baris (flush di ROW 2, refresh
+# pautan J/K) dalam sheet yang sama tidak boleh berselang-seli
+def kunci_tulis():
+    return tenant_semasa().state("kunci_tulis", asyncio.Lock)
+
+
+def simpan_rekod(tarikh_iso, row):
+    journal.enqueue(tarikh_iso, row)
+    # rekod terus kelihatan dalam "Semak Rekod" walaupun belum di-flush
+    record_store.record_written(tarikh_iso, row)
+    rollup_store.record_written(tarikh_iso, row)
+    conflict_index.record_written(tarikh_iso, row)
+    load_index.record_written(tarikh_iso, row)
+    report_cache.invalidate(tarikh_iso)
+    flusher.notify()
 
 
 # ==================================================
-# TARIKH LAIN
+# PAUTAN GAMBAR (SIGNED URL IKUT PERMINTAAN)
 # ==================================================
-async def tarikh_lain(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        await update.message.delete()
-    except:
-        pass
+# Kolum H/I simpan laluan blob "relief/..." yang kekal. URL bertandatangan
+# untuk =IMAGE() di J/K dijana bila perlu, disimpan dalam cache hingga
+# hampir tamat tempoh, dan job berkala membaca formula J/K, menyemak tarikh
+# luput dalam URL, lalu menandatangani semula yang hampir luput secara batch
+# (values_batch_update, LINK_REFRESH_BATCH julat setiap panggilan).
+SIGNED_URL_TTL = int(os.environ.get("SIGNED_URL_TTL", str(7 * 24 * 3600)))
+SIGNED_URL_MARGIN = int(os.environ.get("SIGNED_URL_MARGIN", str(24 * 3600)))
+SIGNED_URL_CACHE_MAX = int(os.environ.get("SIGNED_URL_CACHE_MAX", "20000"))
+LINK_REFRESH_INTERVAL = float(os.environ.get("LINK_REFRESH_INTERVAL", str(6 * 3600)))
+LINK_REFRESH_BATCH = int(os.environ.get("LINK_REFRESH_BATCH", "500"))
+
+
+class UrlResolver:
+    def __init__(self, ttl=SIGNED_URL_TTL, margin=SIGNED_URL_MARGIN, max_entries=SIGNED_URL_CACHE_MAX):
+        self.ttl = ttl
+        self.margin = margin
+        self.max_entries = max_entries
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, path):
+        with self._lock:
+            entry = self._urls.get(path)
+            if entry is not None and entry[1] - time.time() > self.margin:
+                self._urls.move_to_end(path)
+                return entry[0]
+
+        tamat = time.time() + self.ttl
+        with metrics.timer("storage", "sign_url"):
+            url = get_bucket().blob(path).generate_signed_url(
+                version="v4", expiration=timedelta(seconds=self.ttl), method="GET"
+            )
+
+        with self._lock:
+            self._urls[path] = (url, tamat)
+            self._urls.move_to_end(path)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return url
+
+
+url_resolver = TenantLocal("url_resolver", UrlResolver)
+
+
+def path_dari_nilai(nilai):
+    # "relief/..." (baris baru) atau URL lama bertandatangan (baris lama)
+    if nilai.startswith("relief/"):
+        return nilai
+    if nilai.startswith("http"):
+        laluan = urlparse(nilai).path
+        awalan = f"/{tenant_semasa().bucket}/"
+        if laluan.startswith(awalan):
+            return unquote(laluan[len(awalan):])
+    return None
+
+
+def path_paparan(nilai):
+    # Baris baru ada thumbnail; baris lama (URL) hanya ada gambar asal
+    path = path_dari_nilai(nilai)
+    if path is None:
+        return None
+    if IMAGE_NORMALISE and nilai.startswith("relief/"):
+        return thumb_path(path)
+    return path
 
-    today = date.today()
-    context.user_data["calendar_year"] = today.year
-    context.user_data["calendar_month"] = today.month
 
-    await show_calendar(update, context)
+def formula_image(path):
+    return f'=IMAGE("{url_resolver.resolve(path)}")'
 
 
-# ==================================================
-# SHOW CALENDAR
-# ==================================================
-async def show_calendar(update, context):
+RE_FORMULA_IMAGE = re.compile(r'^=IMAGE\("([^"]+)"\)$')
+RE_FORMULA_SEL = re.compile(r"^=IMAGE\(([HI])\d+\)$")
 
-    year = context.user_data["calendar_year"]
-    month = context.user_data["calendar_month"]
-    today = date.today()
 
-    first_day = date(year, month, 1)
-    start_weekday = first_day.weekday()
-    days_in_month = (date(year + (month // 12), ((month % 12) + 1), 1) - timedelta(days=1)).day
+@functools.lru_cache(maxsize=4096)
+def tamat_pautan(url):
+    # X-Goog-Date + X-Goog-Expires dalam URL v4; None jika bukan URL bertandatangan
+    q = parse_qs(urlparse(url).query)
+    try:
+        mula = datetime.strptime(q["X-Goog-Date"][0], "%Y%m%dT%H%M%SZ").replace(tzinfo=pytz.utc)
+        return mula.timestamp() + int(q["X-Goog-Expires"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def url_formula(formula, row):
+    m = RE_FORMULA_IMAGE.match(formula)
+    if m:
+        return m.group(1)
+    # baris lama: =IMAGE(H5) merujuk URL dalam kolum H/I
+    m = RE_FORMULA_SEL.match(formula)
+    if m:
+        idx = 7 if m.group(1) == "H" else 8
+        return row[idx] if len(row) > idx else ""
+    return ""
+
+
+def perlu_tandatangan(url, had):
+    tamat = tamat_pautan(url) if url else None
+    return tamat is None or tamat <= had
+
+
+def refresh_pautan(tarikh_list):
+    had = time.time() + SIGNED_URL_MARGIN
+    bilangan = 0
+    client = get_sheets_client()
+    for nama_tab in dict.fromkeys(nama_tab_bulan(t) for t in tarikh_list):
+        try:
+            sheet = client.worksheet(nama_tab)
+        except Exception as e:
+            if boleh_cuba_semula(e):
+                raise
+            # tab bulan belum wujud: tiada pautan untuk diperbaharui
+            continue
+        # A-I (laluan blob) & J-K (formula) dalam satu bacaan terus dari sheet
+        # supaya nombor baris tepat; cache rekod (LRU kecil) tidak disentuh
+        rows = sheet.get_formulas("A2:K")
+
+        data = []
+        for i, r in enumerate(rows):
+            if len(r) < 9:
+                continue
+            f = list(r[9:11]) + [""] * (2 - len(r[9:11]))
+            paths = [path_paparan(r[7]), path_paparan(r[8])]
+            if not any(
+                p and perlu_tandatangan(url_formula(f[j], r), had)
+                for j, p in enumerate(paths)
+            ):
+                continue
+            no_baris = i + 2
+            data.append({
+                "range": f"'{sheet.title}'!J{no_baris}:K{no_baris}",
+                "values": [[formula_image(p) if p else "" for p in paths]]
+            })
+
+        for mula in range(0, len(data), LINK_REFRESH_BATCH):
+            get_sheets_client().values_batch_update({
+                "valueInputOption": "USER_ENTERED",
+                "data": data[mula:mula + LINK_REFRESH_BATCH]
+            })
+        bilangan += len(data)
+    return bilangan
+
+
+def bulan_aktif():
+    # satu tarikh bagi setiap tab bulan (12 bulan terakhir): URL v4 luput
+    # selepas 7 hari, jadi =IMAGE() dalam tab lama juga perlu diperbaharui
+    awal = date.today().replace(day=1)
+    hasil = [date.today().strftime("%Y-%m-%d")]
+    for _ in range(11):
+        awal = (awal - timedelta(days=1)).replace(day=1)
+        hasil.append(awal.strftime("%Y-%m-%d"))
+    return hasil
+
+
+async def refresh_pautan_tenant(tenant):
+    with guna_tenant(tenant):
+        async with kunci_tulis():
+            # kedudukan baris hanya tepat bila tiada rekod tertunda
+            if journal.count(tenant.kunci):
+                return
+            try:
+                bilangan = await sheets_io.run_habis(refresh_pautan, bulan_aktif())
+            except Exception as e:
+                print("LINK REFRESH ERROR:", tenant.kunci, e)
+                return
+    if bilangan:
+        print(f"🔗 {tenant.kunci}: {bilangan} pautan gambar ditandatangani semula")
+
+
+async def job_refresh_pautan(context: ContextTypes.DEFAULT_TYPE):
+    # semua sekolah, termasuk yang terbiar: pautan luput walaupun tiada update
+    for tenant in tenant_pool.semua():
+        await refresh_pautan_tenant(tenant)
+
+
+def jadual_refresh_pautan(app):
+    if app.job_queue is None:
+        return
+    app.job_queue.run_repeating(
+        job_refresh_pautan,
+        interval=LINK_REFRESH_INTERVAL,
+        first=60,
+        name="refresh_pautan"
+    )
+
+
+# ==================================================
+# ARKIB TAHUNAN (TAB AKTIF KEKAL KECIL)
+# ==================================================
+# Setiap malam, rekod dengan tarikh lebih lama daripada ARCHIVE_AFTER_DAYS
+# dipindahkan dari tab bulan aktif ke spreadsheet arkib tahun itu (tab
+# bulan yang sama, kolum A-I). Tab ARCHIVE_INDEX_TAB dalam spreadsheet
+# aktif merekod bulan -> (spreadsheet arkib, tab), jadi indeks konflik,
+# kaunter beban penggal, eksport & semakan tarikh lama tetap lengkap.
+# Tenant tanpa spreadsheet arkib (ARCHIVE_SHEETS_JSON / "arkib") dilangkau.
+# Minimum 8 hari: analisis 7 hari sentiasa dibaca dari tab aktif.
+ARCHIVE_AFTER_DAYS = max(8, int(os.environ.get("ARCHIVE_AFTER_DAYS", "35")))
+ARCHIVE_JOB_TIME = os.environ.get("ARCHIVE_JOB_TIME", "02:30")
+ARCHIVE_INDEX_TAB = os.environ.get("ARCHIVE_INDEX_TAB", "Indeks Arkib")
+ARCHIVE_CACHE_TTL = float(os.environ.get("ARCHIVE_CACHE_TTL", str(6 * 3600)))
+ARCHIVE_CACHE_MAX = int(os.environ.get("ARCHIVE_CACHE_MAX", "12"))
+arkib_io = AsyncBackend("arkib", 1, float(os.environ.get("ARCHIVE_TIMEOUT", "600")))
+
+LAJUR_INDEKS_ARKIB = ["Bulan", "Spreadsheet", "Tab", "Bilangan"]
+
+
+def had_arkib():
+    return (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+
+
+def get_arkib_client(sheet_id):
+    tenant = tenant_semasa()
+    return SheetsClient(tenant.state(
+        f"arkib:{sheet_id}",
+        lambda: panggil_sheets("read", "open_by_key", get_gc().open_by_key, sheet_id)
+    ))
+
+
+class ArchiveStore:
+    def __init__(self, ttl=ARCHIVE_CACHE_TTL, max_entries=ARCHIVE_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._indeks = None
+        self._bulan = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def indeks(self):
+        # "YYYY-MM" -> (sheet_id arkib, tab, bilangan)
+        if not tenant_semasa().arkib:
+            return {}
+        with self._lock:
+            if self._indeks is not None and self._indeks[0] > time.monotonic():
+                return self._indeks[1]
+        return self._flight.do("__indeks__", self._muat_indeks)
+
+    def _muat_indeks(self):
+        try:
+            rows = get_sheets_client().worksheet(ARCHIVE_INDEX_TAB).get_all_values()
+        except Exception as e:
+            if boleh_cuba_semula(e):
+                raise
+            # belum ada arkib
+            rows = []
+
+        indeks = {}
+        for r in rows[1:]:
+            if len(r) >= 3 and r[0]:
+                indeks[r[0]] = (r[1], r[2], int(r[3]) if len(r) > 3 and str(r[3]).isdigit() else 0)
+        with self._lock:
+            self._indeks = (time.monotonic() + self.ttl, indeks)
+        return indeks
+
+    def rows_bulan(self, tarikh_iso):
+        bulan = tarikh_iso[:7]
+        entry = self.indeks().get(bulan)
+        if entry is None:
+            return []
+
+        with self._lock:
+            cached = self._bulan.get(bulan)
+            if cached is not None and cached[0] > time.monotonic():
+                self._bulan.move_to_end(bulan)
+                return cached[1]
+        return self._flight.do(bulan, lambda: self._muat_bulan(bulan, entry[0], entry[1]))
+
+    def _muat_bulan(self, bulan, sheet_id, nama_tab):
+        rows = get_arkib_client(sheet_id).worksheet(nama_tab).get_all_values()
+        data = [r for r in rows[1:] if len(r) > 1 and r[1][:7] == bulan]
+        with self._lock:
+            self._bulan[bulan] = (time.monotonic() + self.ttl, data)
+            self._bulan.move_to_end(bulan)
+            while len(self._bulan) > self.max_entries:
+                self._bulan.popitem(last=False)
+        return data
+
+    def rows_for_date(self, tarikh_iso):
+        return [r for r in self.rows_bulan(tarikh_iso) if r[1] == tarikh_iso]
+
+    def invalidate(self):
+        with self._lock:
+            self._indeks = None
+            self._bulan.clear()
+
+
+arkib_store = TenantLocal("arkib_store", ArchiveStore)
+
+
+def rekod_bulan(tarikh_iso):
+    # tab aktif + rekod bulan yang sama dalam arkib (jika ada)
+    tab = record_store.get_tab(tarikh_iso)
+    arkib = arkib_store.rows_bulan(tarikh_iso)
+    if not arkib:
+        return tab
+    return MonthTab(tab.rows + arkib, tab.expires_at)
+
+
+def rekod_ringkas(tabs):
+    # {nama_tab: tarikh} -> {nama_tab: baris kolum A-E}. Tab yang sudah dalam
+    # cache rekod diguna terus; yang lain dibaca dalam SATU values_batch_get.
+    hasil, baca = {}, {}
+    for nama_tab, t in tabs.items():
+        tab = record_store.peek_tab(t)
+        if tab is not None:
+            hasil[nama_tab] = tab.rows
+        else:
+            baca[nama_tab] = t
+
+    if baca:
+        client = get_sheets_client()
+        # tab yang belum wujud akan menggagalkan seluruh batch
+        ada = client.senarai_tab()
+        baca = [n for n in baca if n in ada]
+        if baca:
+            respons = client.values_batch_get([f"'{n}'!A2:E" for n in baca])
+            for nama_tab, vr in zip(baca, respons.get("valueRanges", [])):
+                hasil[nama_tab] = vr.get("values", [])
+
+    for nama_tab, t in tabs.items():
+        arkib = arkib_store.rows_bulan(t)
+        hasil[nama_tab] = hasil.get(nama_tab, []) + arkib
+    return hasil
+
+
+def julat_berturutan(baris):
+    # [3, 4, 5, 9] -> [(3, 6), (9, 10)] (indeks mula, indeks akhir eksklusif)
+    julat = []
+    for b in sorted(baris):
+        if julat and julat[-1][1] == b:
+            julat[-1][1] = b + 1
+        else:
+            julat.append([b, b + 1])
+    return [tuple(j) for j in julat]
+
+
+def tarikh_sah(nilai):
+    try:
+        date.fromisoformat(nilai)
+        return True
+    except ValueError:
+        return False
+
+
+def arkib_rekod():
+    tenant = tenant_semasa()
+    had = had_arkib()
+    client = get_sheets_client()
+
+    # Semua tab bulan aktif dibaca dalam satu values_batch_get
+    tabs = []
+    for nama_tab in BULAN_MAP.values():
+        try:
+            tabs.append(client.worksheet(nama_tab))
+        except Exception as e:
+            if boleh_cuba_semula(e):
+                raise
+    if not tabs:
+        return 0
+    hasil = client.values_batch_get([f"'{ws.title}'!A2:I" for ws in tabs])
+
+    pindah = {}
+    padam = {}
+    for ws, vr in zip(tabs, hasil.get("valueRanges", [])):
+        for i, r in enumerate(vr.get("values", [])):
+            if len(r) < 2 or not tarikh_sah(r[1]) or r[1] >= had:
+                continue
+            if r[1][:4] not in tenant.arkib:
+                continue
+            pindah.setdefault(r[1][:7], []).append(r + [""] * (len(LAJUR_EKSPORT) - len(r)))
+            # indeks 0 = header, A2 = 1
+            padam.setdefault(ws.id, []).append(i + 1)
+    if not pindah:
+        return 0
+
+    # 1. salin ke arkib; baris yang sudah ada (job lepas terhenti separuh
+    #    jalan) tidak disalin dua kali
+    indeks = dict(arkib_store.indeks())
+    for bulan, rows in pindah.items():
+        sheet_id = tenant.arkib[bulan[:4]]
+        arkib = get_arkib_client(sheet_id)
+        ws = arkib.pastikan_tab(nama_tab_bulan(f"{bulan}-01"), LAJUR_EKSPORT)
+        sedia_ada = {tuple(r[:len(LAJUR_EKSPORT)]) for r in ws.get_all_values()[1:]}
+        baru = [r for r in rows if tuple(r) not in sedia_ada]
+        if baru:
+            arkib.values_append(f"'{ws.title}'!A:I", baru)
+        indeks[bulan] = (sheet_id, ws.title, len(sedia_ada) + len(baru))
+
+    # 2. indeks dikemas kini sebelum rekod dipadam dari tab aktif
+    ws_indeks = client.pastikan_tab(ARCHIVE_INDEX_TAB, LAJUR_INDEKS_ARKIB)
+    jadual = [LAJUR_INDEKS_ARKIB] + [[b, *indeks[b]] for b in sorted(indeks)]
+    client.values_batch_update({
+        "valueInputOption": "RAW",
+        "data": [{"range": f"'{ws_indeks.title}'!A1:D{len(jadual)}", "values": jadual}]
+    })
+
+    # 3. padam dari tab aktif, julat berturutan dari bawah ke atas
+    requests = []
+    for sheet_id, baris in padam.items():
+        for mula, akhir in reversed(julat_berturutan(baris)):
+            requests.append({
+                "deleteDimension": {
+                    "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": mula, "endIndex": akhir}
+                }
+            })
+    client.batch_update({"requests": requests})
+
+    # rekod tetap sama (aktif + arkib), cuma kedudukan berubah
+    arkib_store.invalidate()
+    record_store.invalidate()
+    return sum(len(b) for b in padam.values())
+
+
+async def arkib_tenant(tenant):
+    if not tenant.arkib:
+        return
+    with guna_tenant(tenant):
+        async with kunci_tulis():
+            # padam baris ikut kedudukan: hanya bila tiada rekod tertunda
+            if journal.count(tenant.kunci):
+                return
+            try:
+                bilangan = await arkib_io.run_habis(arkib_rekod)
+            except Exception as e:
+                print("ARCHIVE ERROR:", tenant.kunci, e)
+                return
+    if bilangan:
+        print(f"🗄 {tenant.kunci}: {bilangan} rekod dipindahkan ke arkib")
+
+
+async def job_arkib(context: ContextTypes.DEFAULT_TYPE):
+    for tenant in tenant_pool.semua():
+        await arkib_tenant(tenant)
+
+
+def jadual_arkib(app):
+    if app.job_queue is None:
+        return
+
+    jam, minit = (int(x) for x in ARCHIVE_JOB_TIME.split(":"))
+    app.job_queue.run_daily(
+        job_arkib,
+        time=dtime(jam, minit, tzinfo=TIMEZONE),
+        name="arkib"
+    )
+
+
+# ==================================================
+# CARTA (PROCESS POOL, PNG DALAM MEMORI)
+# ==================================================
+# Lima carta dilukis serentak dalam proses berasingan (backend Agg),
+# jadi event loop tidak tersekat & tiada fail .png dikongsi dalam cwd.
+# CHART_BACKEND=reportlab: carta vektor reportlab.graphics terus dalam
+# PDF; matplotlib & process pool tidak digunakan langsung.
+CHART_BACKEND = os.environ.get("CHART_BACKEND", "matplotlib")
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", "2"))
+
+_chart_pool = None
+
+
+def get_chart_pool():
+    global _chart_pool
+    if _chart_pool is None:
+        _chart_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS)
+    return _chart_pool
+
+
+def tutup_chart_pool():
+    global _chart_pool
+    if _chart_pool is not None:
+        _chart_pool.shutdown(wait=False, cancel_futures=True)
+        _chart_pool = None
+
+
+def carta_vektor(senarai):
+    return [lukis(counter, tajuk_carta) for _, _, lukis, counter, tajuk_carta in senarai]
+
+
+async def render_carta(kelas, subjek, guru_ganti, guru_diganti):
+    senarai = [
+        ("🏫 Kelas Paling Banyak Diganti", plot_bar, lukis_bar, kelas, "Kelas Diganti"),
+        ("📚 Subjek Paling Banyak Diganti", plot_bar, lukis_bar, subjek, "Subjek Diganti"),
+        ("👨‍🏫 Guru Paling Banyak Mengganti", plot_bar, lukis_bar, guru_ganti, "Guru Mengganti"),
+        ("👤 Guru Paling Banyak Diganti", plot_bar, lukis_bar, guru_diganti, "Guru Diganti"),
+        ("👨‍🏫 Guru Paling Kurang Mengganti", plot_bar_kurang, lukis_bar_kurang, guru_ganti,
+         "Guru Paling Kurang Mengganti"),
+    ]
+
+    if CHART_BACKEND == "reportlab":
+        hasil = await report_io.run(carta_vektor, senarai)
+    else:
+        loop = asyncio.get_running_loop()
+        pool = get_chart_pool()
+        hasil = await asyncio.gather(*[
+            loop.run_in_executor(pool, fn, counter, tajuk_carta)
+            for _, fn, _, counter, tajuk_carta in senarai
+        ])
+
+    return [(tajuk, carta) for (tajuk, *_), carta in zip(senarai, hasil) if carta]
+
+
+# ==================================================
+# CACHE LAPORAN PDF (FILE_ID TELEGRAM)
+# ==================================================
+# PDF yang sama tidak dijana & dimuat naik semula selagi data minggu
+# tersebut tidak berubah; Telegram cukup dihantar file_id lama.
+REPORT_CACHE_MAX = int(os.environ.get("REPORT_CACHE_MAX", "4"))
+
+
+class ReportCache:
+    def __init__(self, max_entries=REPORT_CACHE_MAX):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, kunci, versi):
+        entry = self._entries.get(kunci)
+        if entry is None or entry[0] != versi:
+            return None
+        self._entries.move_to_end(kunci)
+        return entry[1]
+
+    def put(self, kunci, versi, file_id):
+        self._entries[kunci] = (versi, file_id)
+        self._entries.move_to_end(kunci)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tarikh_iso):
+        # kunci = (ahad, khamis, hari_ini); data laporan = 7 hari hingga hari_ini
+        tarikh = datetime.strptime(tarikh_iso, "%Y-%m-%d").date()
+        for kunci in [k for k in self._entries if k[2] - timedelta(days=6) <= tarikh <= k[2]]:
+            del self._entries[kunci]
+
+
+report_cache = TenantLocal("report_cache", ReportCache)
+
+
+def kunci_laporan():
+    ahad, khamis = get_julat_ahad_khamis()
+    return (ahad, khamis, date.today())
+
+
+CAPTION_LAPORAN = "📊 Laporan Analisis Relief Mingguan"
+
+
+async def bina_laporan_mingguan():
+    kelas, subjek, guru_ganti, guru_diganti = await sheets_io.run(get_data_7_hari)
+
+    if not kelas:
+        return None
+
+    files = await render_carta(kelas, subjek, guru_ganti, guru_diganti)
+    tenant = tenant_semasa()
+    return await report_io.run(
+        bina_pdf, files, guru_ganti, tenant.guru, tenant.nama, tenant.moto, tenant.tagar
+    )
+
+
+async def hantar_laporan(bot, chat_id, kunci, versi, pdf):
+    msg = await bot.send_document(
+        chat_id=chat_id,
+        document=pdf,
+        filename=f"Analisis_Relief_{date.today()}.pdf",
+        caption=CAPTION_LAPORAN
+    )
+
+    report_cache.put(kunci, versi, msg.document.file_id)
+    return msg.document.file_id
+
+
+@diukur
+async def analisis_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    kunci = kunci_laporan()
+    versi = await sheets_io.run(rollup_store.versi, senarai_7_hari())
+
+    file_id = report_cache.get(kunci, versi)
+    if file_id:
+        await update.message.reply_document(document=file_id, caption=CAPTION_LAPORAN)
+        return
+
+    await update.message.reply_text("⏳ Menjana laporan analisis mingguan...")
+
+    pdf = await bina_laporan_mingguan()
+
+    if pdf is None:
+        await update.message.reply_text("Tiada data relief untuk 7 hari terakhir.")
+        return
+
+    await hantar_laporan(context.bot, update.effective_chat.id, kunci, versi, pdf)
+
+
+# ==================================================
+# LAPORAN BERJADUAL (JOBQUEUE)
+# ==================================================
+# Laporan dijana lebih awal (hari & masa boleh ditetapkan) dan dihantar
+# kepada admin setiap sekolah; permintaan manual selepas itu guna file_id cache.
+# REPORT_JOB_DAYS: 0 = Ahad ... 6 = Sabtu (ikut JobQueue PTB v20)
+TIMEZONE = pytz.timezone("Asia/Kuala_Lumpur")
+REPORT_JOB_DAYS = tuple(int(d) for d in os.environ.get("REPORT_JOB_DAYS", "4").split(","))
+REPORT_JOB_TIME = os.environ.get("REPORT_JOB_TIME", "14:00")
+
+
+async def laporan_tenant(bot, tenant):
+    kunci = kunci_laporan()
+    versi = await sheets_io.run(rollup_store.versi, senarai_7_hari())
+
+    file_id = report_cache.get(kunci, versi)
+    pdf = None
+    if file_id is None:
+        pdf = await bina_laporan_mingguan()
+        if pdf is None:
+            return
+
+    for admin_id in tenant.admin_ids:
+        try:
+            if file_id:
+                await bot.send_document(chat_id=admin_id, document=file_id, caption=CAPTION_LAPORAN)
+            else:
+                file_id = await hantar_laporan(bot, admin_id, kunci, versi, pdf)
+        except Exception as e:
+            print("REPORT JOB ERROR:", tenant.kunci, admin_id, e)
+
+
+@diukur
+async def job_laporan_mingguan(context: ContextTypes.DEFAULT_TYPE):
+    for tenant in tenant_pool.semua():
+        with guna_tenant(tenant):
+            try:
+                await laporan_tenant(context.bot, tenant)
+            except Exception as e:
+                print("REPORT JOB ERROR:", tenant.kunci, e)
+
+
+def jadual_laporan(app):
+    if app.job_queue is None:
+        print("⚠️ JobQueue tiada (pasang python-telegram-bot[job-queue]); laporan berjadual dimatikan.")
+        return
+
+    jam, minit = (int(x) for x in REPORT_JOB_TIME.split(":"))
+    app.job_queue.run_daily(
+        job_laporan_mingguan,
+        time=dtime(jam, minit, tzinfo=TIMEZONE),
+        days=REPORT_JOB_DAYS,
+        name="laporan_mingguan"
+    )
+
+
+# ==================================================
+# START
+# ==================================================
+@diukur
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.clear()
+    batal_upload(update.effective_user.id)
+
+    reply_keyboard = [
+    [KeyboardButton("🟢 Hari Ini"), KeyboardButton("📅 Tarikh Lain")],
+    [KeyboardButton("📊 Semak Rekod Hari Ini"), KeyboardButton("📈 Analisis Mingguan (PDF)")],
+    [KeyboardButton("📊 Lihat Rekod Penuh (Admin)")]
+]
+
+
+    await update.message.reply_text(
+        "🤖 *Relief Check-In Tracker*\n\nPilih tindakan:",
+        reply_markup=ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True),
+        parse_mode="Markdown"
+    )
+
+
+# ==================================================
+# SEMAK REKOD HARI INI
+# ==================================================
+@diukur
+async def semak_rekod(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    today_iso = datetime.now().strftime("%Y-%m-%d")
+    today_display = datetime.now().strftime("%d/%m/%Y")
+
+    # PATCH: baca tab ikut bulan semasa (melalui cache rekod)
+    rekod = await baca_rekod_tarikh(today_iso)
+
+    if not rekod:
+        await update.message.reply_text(
+            f"📊 *Rekod Relief Hari Ini*\n📅 {today_display}\n\nTiada rekod direkodkan.",
+            parse_mode="Markdown"
+        )
+        return
+
+    mesej = f"📊 *REKOD RELIEF HARI INI*\n📅 {today_display}\n\n"
+
+    for i, r in enumerate(rekod, start=1):
+        mesej += (
+            f"{i}️⃣ {r[2]}\n"
+            f"👨‍🏫 Pengganti: {r[3]}\n"
+            f"👤 Diganti: {r[4]}\n"
+            f"🏫 {r[5]}\n"
+            f"📚 {r[6]}\n\n"
+        )
+
+    await update.message.reply_text(mesej, parse_mode="Markdown")
+
+
+# ==================================================
+# ADMIN LOCK
+# ==================================================
+@diukur
+async def lihat_penuh(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in tenant_semasa().admin_ids:
+        await update.message.reply_text(
+            "⛔ *Akses Terhad*\n\nHanya pentadbir boleh melihat rekod penuh.",
+            parse_mode="Markdown"
+        )
+        return
+
+    await update.message.reply_text("📊 *Rekod Relief Penuh:*", parse_mode="Markdown")
+    await update.message.reply_text(tenant_semasa().sheet_url)
+
+
+@diukur
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in tenant_semasa().admin_ids:
+        await update.message.reply_text(
+            "⛔ *Akses Terhad*\n\nHanya pentadbir boleh melihat statistik.",
+            parse_mode="Markdown"
+        )
+        return
+
+    await update.message.reply_text(f"📈 Statistik Bot\n\n{metrics.ringkasan()}")
+
+
+# ==================================================
+# EKSPORT JULAT TARIKH (CSV / XLSX)
+# ==================================================
+# /eksport 2026-01-01 2026-03-31 [csv|xlsx]
+# Setiap tab bulan dibaca berperingkat: EXPORT_BATCH_RANGES julat x
+# EXPORT_PAGE_ROWS baris dalam satu values_batch_get. Baris terus ditulis
+# ke fail sementara melalui generator, jadi memori tidak bergantung pada
+# panjang julat.
+EXPORT_PAGE_ROWS = int(os.environ.get("EXPORT_PAGE_ROWS", "1000"))
+EXPORT_BATCH_RANGES = int(os.environ.get("EXPORT_BATCH_RANGES", "5"))
+EXPORT_MAX_DAYS = int(os.environ.get("EXPORT_MAX_DAYS", "366"))
+export_io = AsyncBackend("export", 1, float(os.environ.get("EXPORT_TIMEOUT", "600")))
+
+LAJUR_EKSPORT = [
+    "Timestamp", "Tarikh", "Masa", "Guru Pengganti", "Guru Diganti",
+    "Kelas", "Subjek", "Gambar 1", "Gambar 2"
+]
+
+
+def bulan_dalam_julat(mula, akhir):
+    bulan = mula.replace(day=1)
+    while bulan <= akhir:
+        yield bulan
+        bulan = (bulan + timedelta(days=32)).replace(day=1)
+
+
+def tab_dalam_julat(mula, akhir):
+    # nama tab tiada tahun: julat > 12 bulan berkongsi tab yang sama
+    tabs = {}
+    for bulan in bulan_dalam_julat(mula, akhir):
+        t = bulan.strftime("%Y-%m-%d")
+        tabs.setdefault(nama_tab_bulan(t), t)
+    return list(tabs)
+
+
+def baris_tab(client, ws, mula_iso, akhir_iso):
+    # Julat A1 yang melepasi grid ditolak Sheets ("exceeds grid limits"),
+    # jadi setiap halaman dihadkan kepada row_count. row_count dari metadata
+    # mungkin lapuk (baris baru dimasukkan di ROW 2 menolak grid ke bawah),
+    # jadi halaman terakhir dibiarkan terbuka: A{a}:I hingga hujung grid.
+    had = ws.row_count
+    baris = 2
+    while baris <= had:
+        julat = []
+        while baris <= had and len(julat) < EXPORT_BATCH_RANGES:
+            b = min(baris + EXPORT_PAGE_ROWS - 1, had)
+            julat.append((baris, b, b >= had))
+            baris = b + 1
+
+        hasil = client.values_batch_get([
+            f"'{ws.title}'!A{a}:I" if akhir else f"'{ws.title}'!A{a}:I{b}" for a, b, akhir in julat
+        ])
+        for (a, b, akhir), vr in zip(julat, hasil.get("valueRanges", [])):
+            values = vr.get("values", [])
+            for r in values:
+                if len(r) > 1 and mula_iso <= r[1] <= akhir_iso:
+                    yield r + [""] * (len(LAJUR_EKSPORT) - len(r))
+
+            # baris kosong di hujung tidak dipulangkan: data sudah habis
+            if akhir or len(values) < b - a + 1:
+                return
+
+
+def baris_eksport(mula, akhir):
+    mula_iso, akhir_iso = mula.isoformat(), akhir.isoformat()
+    client = get_sheets_client()
+
+    for nama_tab in tab_dalam_julat(mula, akhir):
+        try:
+            ws = client.worksheet(nama_tab)
+        except Exception as e:
+            if boleh_cuba_semula(e):
+                raise
+            print("EXPORT: tab tiada:", nama_tab)
+            continue
+        yield from baris_tab(client, ws, mula_iso, akhir_iso)
+
+    # bulan yang sudah dipindahkan ke arkib tahunan
+    indeks = arkib_store.indeks()
+    for bulan in bulan_dalam_julat(mula, akhir):
+        entry = indeks.get(bulan.strftime("%Y-%m"))
+        if entry is None:
+            continue
+        arkib = get_arkib_client(entry[0])
+        yield from baris_tab(arkib, arkib.worksheet(entry[1]), mula_iso, akhir_iso)
+
+
+def eksport_fail(mula, akhir, jenis):
+    f = tempfile.TemporaryFile()
+    bilangan = 0
+
+    if jenis == "xlsx":
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Relief")
+        ws.append(LAJUR_EKSPORT)
+        for r in baris_eksport(mula, akhir):
+            ws.append(r)
+            bilangan += 1
+        wb.save(f)
+    else:
+        teks = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        writer = csv.writer(teks)
+        writer.writerow(LAJUR_EKSPORT)
+        for r in baris_eksport(mula, akhir):
+            writer.writerow(r)
+            bilangan += 1
+        teks.flush()
+        teks.detach()
+
+    f.seek(0)
+    return f, bilangan
+
+
+@diukur
+async def eksport(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in tenant_semasa().admin_ids:
+        await update.message.reply_text(
+            "⛔ *Akses Terhad*\n\nHanya pentadbir boleh mengeksport rekod.",
+            parse_mode="Markdown"
+        )
+        return
+
+    args = context.args or []
+    try:
+        mula = date.fromisoformat(args[0])
+        akhir = date.fromisoformat(args[1]) if len(args) > 1 else date.today()
+    except (IndexError, ValueError):
+        mula = akhir = None
+    jenis = args[2].lower() if len(args) > 2 else "csv"
+
+    if mula is None or jenis not in ("csv", "xlsx"):
+        await update.message.reply_text(
+            "📤 Guna: /eksport TARIKH_MULA [TARIKH_AKHIR] [csv|xlsx]\n"
+            "Contoh: /eksport 2026-01-01 2026-03-31 xlsx"
+        )
+        return
+    if akhir < mula or (akhir - mula).days >= EXPORT_MAX_DAYS:
+        await update.message.reply_text(f"❌ Julat tarikh tidak sah (maksimum {EXPORT_MAX_DAYS} hari).")
+        return
+
+    await update.message.reply_text("⏳ Sedang menyediakan fail eksport...")
+    # rekod yang masih dalam journal ditulis dahulu supaya turut dieksport
+    await flusher.flush()
+
+    try:
+        f, bilangan = await export_io.run(eksport_fail, mula, akhir, jenis)
+    except ImportError:
+        await update.message.reply_text("⚠️ Eksport XLSX tidak tersedia. Sila guna csv.")
+        return
+    except Exception as e:
+        print("EXPORT ERROR:", e)
+        metrics.ralat("handler", "eksport")
+        await update.message.reply_text("⚠️ Eksport gagal. Sila cuba semula sebentar lagi.")
+        return
+
+    with f:
+        await update.message.reply_document(
+            document=f,
+            filename=f"relief_{mula.isoformat()}_{akhir.isoformat()}.{jenis}",
+            caption=f"📤 {bilangan} rekod ({format_tarikh_bm(mula.isoformat())} - {format_tarikh_bm(akhir.isoformat())})"
+        )
+
+
+# ==================================================
+# HARI INI
+# ==================================================
+@diukur
+async def hari_ini(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await update.message.delete()
+    except:
+        pass
+
+    context.user_data["tarikh"] = datetime.now().strftime("%Y-%m-%d")
+
+    msg = await update.effective_chat.send_message(
+        "📅 Tarikh: *Hari Ini*\n\n⏰ Pilih masa:",
+        reply_markup=KEYBOARD_MASA,
+        parse_mode="Markdown"
+    )
+
+    context.user_data["last_message_id"] = msg.message_id
+
+
+# ==================================================
+# TARIKH LAIN
+# ==================================================
+@diukur
+async def tarikh_lain(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await update.message.delete()
+    except:
+        pass
+
+    today = date.today()
+    context.user_data["calendar_year"] = today.year
+    context.user_data["calendar_month"] = today.month
+
+    await show_calendar(update, context)
+
+
+# ==================================================
+# SHOW CALENDAR
+# ==================================================
+@functools.lru_cache(maxsize=32)
+def calendar_keyboard(year, month, today):
+    first_day = date(year, month, 1)
+    start_weekday = first_day.weekday()
+    days_in_month = (date(year + (month // 12), ((month % 12) + 1), 1) - timedelta(days=1)).day
 
     keyboard = []
 
     keyboard.append([
-        InlineKeyboardButton("⬅️", callback_data=f"cal_nav|{year}|{month-1}"),
-        InlineKeyboardButton(f"{first_day.strftime('%B')} {year}", callback_data="noop"),
-        InlineKeyboardButton("➡️", callback_data=f"cal_nav|{year}|{month+1}")
+        InlineKeyboardButton("⬅️", callback_data=f"cn|{year}|{month-1}"),
+        InlineKeyboardButton(f"{first_day.strftime('%B')} {year}", callback_data="x"),
+        InlineKeyboardButton("➡️", callback_data=f"cn|{year}|{month+1}")
     ])
 
     weekdays = ["Mo","Tu","We","Th","Fr","Sa","Su"]
-    keyboard.append([InlineKeyboardButton(d, callback_data="noop") for d in weekdays])
+    keyboard.append([InlineKeyboardButton(d, callback_data="x") for d in weekdays])
 
     row = []
     for _ in range(start_weekday):
-        row.append(InlineKeyboardButton(" ", callback_data="noop"))
+        row.append(InlineKeyboardButton(" ", callback_data="x"))
 
     for day in range(1, days_in_month + 1):
         tarikh_ini = date(year, month, day)
         label = f"🟢{day}" if tarikh_ini == today else str(day)
 
-        row.append(InlineKeyboardButton(label, callback_data=f"cal_day|{year}|{month}|{day}"))
+        row.append(InlineKeyboardButton(label, callback_data=f"cd|{year}|{month}|{day}"))
 
         if len(row) == 7:
             keyboard.append(row)
@@ -535,12 +3033,20 @@ async def show_calendar(update, context):
 
     if row:
         while len(row) < 7:
-            row.append(InlineKeyboardButton(" ", callback_data="noop"))
+            row.append(InlineKeyboardButton(" ", callback_data="x"))
         keyboard.append(row)
 
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def show_calendar(update, context):
+
+    year = context.user_data["calendar_year"]
+    month = context.user_data["calendar_month"]
+
     msg = await update.effective_chat.send_message(
         "🗓 Pilih tarikh rekod:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=calendar_keyboard(year, month, date.today())
     )
 
     context.user_data["last_message_id"] = msg.message_id
@@ -549,143 +3055,714 @@ async def show_calendar(update, context):
 # ==================================================
 # CALLBACK FLOW
 # ==================================================
-async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
+def pilih_item(items, idx):
+    try:
+        return items[int(idx)]
+    except (ValueError, IndexError):
+        return None
+
+
+async def cb_noop(query, context):
     await query.answer()
-    data = query.data
 
-    if data.startswith("cal_day|"):
-        _, year, month, day = data.split("|")
 
-        tarikh_obj = date(int(year), int(month), int(day))
-        if tarikh_obj > date.today():
-            await query.answer("❌ Tarikh tidak boleh melebihi hari ini", show_alert=True)
-            return
+async def cb_cal_nav(query, context, year, month):
+    await query.answer()
+    year, month = int(year), int(month)
+    if month < 1:
+        year, month = year - 1, 12
+    elif month > 12:
+        year, month = year + 1, 1
 
-        tarikh_iso = tarikh_obj.strftime("%Y-%m-%d")
-        context.user_data["tarikh"] = tarikh_iso
+    context.user_data["calendar_year"] = year
+    context.user_data["calendar_month"] = month
 
-        keyboard = grid_keyboard(MASA_LIST, "masa", cols=2)
+    await query.edit_message_reply_markup(reply_markup=calendar_keyboard(year, month, date.today()))
 
-        await query.edit_message_text(
-            f"📅 Tarikh dipilih: *{format_tarikh_bm(tarikh_iso)}*\n\n⏰ Pilih masa:",
-            reply_markup=keyboard,
-            parse_mode="Markdown"
+
+async def cb_cal_day(query, context, year, month, day):
+    tarikh_obj = date(int(year), int(month), int(day))
+    if tarikh_obj > date.today():
+        await query.answer("❌ Tarikh tidak boleh melebihi hari ini", show_alert=True)
+        return
+    await query.answer()
+
+    tarikh_iso = tarikh_obj.strftime("%Y-%m-%d")
+    context.user_data["tarikh"] = tarikh_iso
+
+    await query.edit_message_text(
+        f"📅 Tarikh dipilih: *{format_tarikh_bm(tarikh_iso)}*\n\n⏰ Pilih masa:",
+        reply_markup=KEYBOARD_MASA,
+        parse_mode="Markdown"
+    )
+
+
+async def cb_masa(query, context, idx):
+    await query.answer()
+    value = pilih_item(MASA_LIST, idx)
+    if value is None:
+        return
+    context.user_data["masa"] = value
+
+    # guru yang sibuk pada slot ini disembunyikan; beban paling kurang dahulu
+    keyboard = await keyboard_pengganti(context.user_data.get("tarikh", ""), value)
+    await query.edit_message_text(
+        "👨‍🏫 Pilih guru pengganti:\n(bilangan ganti minggu ini / penggal ini)",
+        reply_markup=keyboard
+    )
+
+
+async def cb_guru_pengganti(query, context, idx):
+    value = pilih_item(tenant_semasa().guru, idx)
+    if value is None:
+        await query.answer()
+        return
+    context.user_data["guru_pengganti"] = value
+
+    tarikh_iso = context.user_data.get("tarikh", "")
+    masa = context.user_data.get("masa", "")
+    sedia_ada = await semak_konflik(tarikh_iso, lambda: conflict_index.konflik_guru(tarikh_iso, masa, value))
+
+    amaran = ""
+    if sedia_ada:
+        amaran = (
+            f"⚠️ {value} sudah direkod mengganti di {sedia_ada[5]} "
+            f"pada {format_tarikh_bm(tarikh_iso)}, {masa}."
         )
+    await query.answer(amaran or None, show_alert=bool(amaran))
+
+    teks = "👤 Pilih guru diganti:"
+    if amaran:
+        teks = f"{amaran}\n\n{teks}"
+    await query.edit_message_text(teks, reply_markup=tenant_semasa().keyboard_guru_diganti)
+
+
+async def cb_guru_diganti(query, context, idx):
+    await query.answer()
+    value = pilih_item(tenant_semasa().guru, idx)
+    if value is None:
         return
+    context.user_data["guru_diganti"] = value
+    await query.edit_message_text("🏫 Pilih kelas:", reply_markup=tenant_semasa().keyboard_kelas)
 
-    key, *rest = data.split("|")
-    value = rest[0] if rest else None
-
-    if key == "masa":
-        context.user_data["masa"] = value
-        keyboard = grid_keyboard(GURU_LIST, "guru_pengganti", cols=3, emoji="🟢")
-        await query.edit_message_text("👨‍🏫 Pilih guru pengganti:", reply_markup=keyboard)
-
-    elif key == "guru_pengganti":
-        context.user_data["guru_pengganti"] = value
-        keyboard = grid_keyboard(GURU_LIST, "guru_diganti", cols=3, emoji="🔴")
-        await query.edit_message_text("👤 Pilih guru diganti:", reply_markup=keyboard)
-
-    elif key == "guru_diganti":
-        context.user_data["guru_diganti"] = value
-        keyboard = grid_keyboard(KELAS_LIST, "kelas", cols=3)
-        await query.edit_message_text("🏫 Pilih kelas:", reply_markup=keyboard)
-
-    elif key == "kelas":
-        context.user_data["kelas"] = value
-        keyboard = grid_keyboard(SUBJEK_LIST, "subjek", cols=2)
-        await query.edit_message_text("📚 Pilih subjek:", reply_markup=keyboard)
-
-    elif key == "subjek":
-        context.user_data["subjek"] = value
-        context.user_data["images"] = []
-
-        tarikh_iso = context.user_data.get("tarikh", "")
-        tarikh_bm = format_tarikh_bm(tarikh_iso)
-        hari_bm = get_hari_bm(tarikh_iso)
-
-        await query.edit_message_text(
-            f"📅 *Tarikh Rekod:* {tarikh_bm}\n"
-            f"🗓 *Hari:* {hari_bm}\n"
-            f"⏰ *Masa:* {context.user_data.get('masa','')}\n"
-            f"👨‍🏫 *Guru Pengganti:* {context.user_data.get('guru_pengganti','')}\n"
-            f"👤 *Guru Diganti:* {context.user_data.get('guru_diganti','')}\n"
-            f"🏫 *Kelas:* {context.user_data.get('kelas','')}\n"
-            f"📚 *Subjek:* {context.user_data.get('subjek','')}\n\n"
-            "📸 Sila hantar **2 gambar** kelas relief.",
-            parse_mode="Markdown"
+
+async def cb_kelas(query, context, idx):
+    value = pilih_item(tenant_semasa().kelas, idx)
+    if value is None:
+        await query.answer()
+        return
+    context.user_data["kelas"] = value
+
+    tarikh_iso = context.user_data.get("tarikh", "")
+    masa = context.user_data.get("masa", "")
+    sedia_ada = await semak_konflik(tarikh_iso, lambda: conflict_index.konflik_kelas(tarikh_iso, masa, value))
+
+    amaran = ""
+    if sedia_ada:
+        amaran = (
+            f"⚠️ Kelas {value} pada {format_tarikh_bm(tarikh_iso)}, {masa} "
+            f"sudah direkod (pengganti: {sedia_ada[3]})."
         )
+    await query.answer(amaran or None, show_alert=bool(amaran))
+
+    teks = "📚 Pilih subjek:"
+    if amaran:
+        teks = f"{amaran}\n\n{teks}"
+    await query.edit_message_text(teks, reply_markup=tenant_semasa().keyboard_subjek)
+
+
+async def cb_subjek(query, context, idx):
+    await query.answer()
+    value = pilih_item(tenant_semasa().subjek, idx)
+    if value is None:
+        return
+    context.user_data["subjek"] = value
+    context.user_data["images"] = []
+    batal_upload(query.from_user.id)
+
+    tarikh_iso = context.user_data.get("tarikh", "")
+    tarikh_bm = format_tarikh_bm(tarikh_iso)
+    hari_bm = get_hari_bm(tarikh_iso)
+
+    await query.edit_message_text(
+        f"📅 *Tarikh Rekod:* {tarikh_bm}\n"
+        f"🗓 *Hari:* {hari_bm}\n"
+        f"⏰ *Masa:* {context.user_data.get('masa','')}\n"
+        f"👨‍🏫 *Guru Pengganti:* {context.user_data.get('guru_pengganti','')}\n"
+        f"👤 *Guru Diganti:* {context.user_data.get('guru_diganti','')}\n"
+        f"🏫 *Kelas:* {context.user_data.get('kelas','')}\n"
+        f"📚 *Subjek:* {context.user_data.get('subjek','')}\n\n"
+        "📸 Sila hantar **2 gambar** kelas relief.",
+        parse_mode="Markdown"
+    )
+
+
+CALLBACK_ROUTES = {
+    "x": cb_noop,
+    "cn": cb_cal_nav,
+    "cd": cb_cal_day,
+    "m": cb_masa,
+    "gp": cb_guru_pengganti,
+    "gd": cb_guru_diganti,
+    "k": cb_kelas,
+    "s": cb_subjek,
+}
+
+
+@diukur
+async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    key, *args = query.data.split("|")
+
+    route = CALLBACK_ROUTES.get(key)
+    if route is None:
+        # butang lama / tidak dikenali
+        await query.answer()
+        return
+
+    await route(query, context, *args)
+
+
+# ==================================================
+# MUAT NAIK GAMBAR (TERUS DARI MEMORI, TANPA FAIL)
+# ==================================================
+# Fail besar guna resumable upload (chunk_size mesti gandaan 256 KB)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+RESUMABLE_THRESHOLD = int(os.environ.get("RESUMABLE_THRESHOLD", str(5 * 1024 * 1024)))
+
+# user_id -> [asyncio.Task] untuk gambar yang sedang dimuat naik
+upload_tertunda = {}
+
+# Album (media_group_id): Telegram hantar setiap gambar sebagai update
+# berasingan. Gambar dikumpul ikut (user_id, media_group_id) & terus mula
+# dimuat naik; selepas ALBUM_WAIT saat tanpa gambar baru, seluruh album
+# diproses sebagai satu unit (satu rekod sahaja).
+ALBUM_WAIT = float(os.environ.get("ALBUM_WAIT", "1.0"))
+
+# (user_id, media_group_id) -> {"uploads": [asyncio.Task], "timer": asyncio.Task}
+album_tertunda = {}
+
+
+# Normalisasi: kecilkan & mampatkan semula gambar telefon sebelum muat naik,
+# dan simpan thumbnail (relief/<nama>_thumb.jpg) untuk formula =IMAGE().
+IMAGE_NORMALISE = os.environ.get("IMAGE_NORMALISE", "1") == "1"
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", "1600"))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+THUMB_MAX_SIDE = int(os.environ.get("THUMB_MAX_SIDE", "320"))
+THUMB_QUALITY = int(os.environ.get("THUMB_QUALITY", "70"))
+
+
+def encode_jpeg(img, max_side, quality):
+    img = img.copy()
+    img.thumbnail((max_side, max_side))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def normalise_gambar(data):
+    from PIL import Image as PILImage, ImageOps
+
+    img = PILImage.open(io.BytesIO(data))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    return (
+        encode_jpeg(img, IMAGE_MAX_SIDE, IMAGE_QUALITY),
+        encode_jpeg(img, THUMB_MAX_SIDE, THUMB_QUALITY)
+    )
+
+
+def thumb_path(path):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_thumb{ext}"
+
+
+def upload_bytes(path, data, content_type="image/jpeg"):
+    blob = get_bucket().blob(path)
+    if len(data) > RESUMABLE_THRESHOLD:
+        blob.chunk_size = UPLOAD_CHUNK_SIZE
+    with metrics.timer("storage", "upload"):
+        blob.upload_from_file(io.BytesIO(data), size=len(data), content_type=content_type)
+    # PATCH: sheet simpan laluan blob yang kekal; URL ditandatangani kemudian
+    return path
+
+
+def proses_dan_upload(path, data):
+    thumb = None
+    if IMAGE_NORMALISE:
+        try:
+            data, thumb = normalise_gambar(data)
+        except Exception as e:
+            # gambar asal tetap dimuat naik (juga sebagai thumbnail) jika
+            # normalisasi gagal, supaya <nama>_thumb.jpg sentiasa wujud
+            print("IMAGE ERROR:", e)
+            thumb = data
+    thumb_blob = upload_bytes(thumb_path(path), thumb) if thumb is not None else None
+    return upload_bytes(path, data), thumb_blob
+
+
+async def muat_naik_foto(photo, path):
+    file = await photo.get_file()
+    data = bytes(await file.download_as_bytearray())
+    return await storage_io.run(proses_dan_upload, path, data)
+
+
+async def muat_naik_ke_user_data(photo, path, user_data, tasks, message):
+    # Hasil terus masuk user_data["images"] supaya kekal selepas restart
+    try:
+        blob_path, thumb = await muat_naik_foto(photo, path)
+        user_data.setdefault("images", []).append([blob_path, thumb or ""])
+    except Exception as e:
+        print("UPLOAD ERROR:", e)
+        await message.reply_text("⚠️ Gambar gagal dimuat naik. Sila hantar semula gambar tersebut.")
+    finally:
+        tasks.remove(asyncio.current_task())
+
+
+def batal_upload(user_id):
+    for task in upload_tertunda.pop(user_id, []):
+        task.cancel()
+    for kunci in [k for k in album_tertunda if k[0] == user_id]:
+        album = album_tertunda.pop(kunci)
+        album["timer"].cancel()
+        for task in album["uploads"]:
+            task.cancel()
+
+
+def nama_fail_gambar(user_id, photo):
+    # file_unique_id menjamin nama unik walaupun dua gambar tiba dalam saat yang sama
+    return f"relief/{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{photo.file_unique_id}.jpg"
 
 
 # ==================================================
 # IMAGE HANDLER (PATCH DI SINI)
 # ==================================================
+async def rekod_jika_lengkap(user_id, user_data, message):
+    # Tiada await sebelum user_data.clear(): rekod hanya boleh ditulis sekali
+    images = user_data.get("images", [])
+    if len(images) < 2:
+        return
+
+    upload_tertunda.pop(user_id, None)
+    (img1, thumb1), (img2, thumb2) = images[:2]
+
+    tarikh_iso = user_data.get(
+        "tarikh", datetime.now().strftime("%Y-%m-%d")
+    )
+
+    row = [
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        tarikh_iso,
+        user_data.get("masa", ""),
+        user_data.get("guru_pengganti", ""),
+        user_data.get("guru_diganti", ""),
+        user_data.get("kelas", ""),
+        user_data.get("subjek", ""),
+        img1,
+        img2,
+        thumb1 or "",
+        thumb2 or ""
+    ]
+
+    simpan_rekod(tarikh_iso, row)
+
+    user_data.clear()
+    await message.reply_text("✅ Rekod kelas relief berjaya dihantar.\nTerima kasih cikgu 😊")
+
+
+async def selesai_album(kunci, user_data, message):
+    await asyncio.sleep(ALBUM_WAIT)
+    # dikeluarkan sebelum await seterusnya: gambar lewat mula album baru
+    album = album_tertunda.pop(kunci, None)
+    if album is None:
+        return
+
+    try:
+        hasil = await asyncio.gather(*album["uploads"], return_exceptions=True)
+        gagal = 0
+        for h in hasil:
+            if isinstance(h, BaseException):
+                print("UPLOAD ERROR:", h)
+                gagal += 1
+                continue
+            blob_path, thumb = h
+            user_data.setdefault("images", []).append([blob_path, thumb or ""])
+
+        if gagal:
+            await message.reply_text(
+                f"⚠️ {gagal} gambar gagal dimuat naik. Sila hantar semula gambar tersebut."
+            )
+        await rekod_jika_lengkap(kunci[0], user_data, message)
+
+    except Exception as e:
+        print("SYSTEM ERROR:", e)
+        metrics.ralat("handler", "album")
+        await message.reply_text(
+            "⚠️ Berlaku ralat semasa proses muat naik.\nSila cuba semula atau maklumkan pentadbir."
+        )
+
+
+def terima_album(update, context):
+    user = update.effective_user
+    photo = update.message.photo[-1]
+    kunci = (user.id, update.message.media_group_id)
+
+    album = album_tertunda.get(kunci)
+    if album is None:
+        album = album_tertunda[kunci] = {"uploads": [], "timer": None}
+    else:
+        album["timer"].cancel()
+
+    # hanya 2 gambar pertama diperlukan untuk satu rekod
+    perlu = 2 - len(context.user_data.get("images", []))
+    if len(album["uploads"]) < perlu:
+        album["uploads"].append(asyncio.create_task(
+            muat_naik_foto(photo, nama_fail_gambar(user.id, photo))
+        ))
+    # application.create_task(update=...): user_data yang diubah selepas
+    # handler tamat tetap ditanda untuk ditulis oleh persistence
+    album["timer"] = context.application.create_task(
+        selesai_album(kunci, context.user_data, update.message), update=update
+    )
+
+
+@diukur
 async def gambar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
-        photo = update.message.photo[-1]
-        file = await photo.get_file()
-        filename = f"{user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        await file.download_to_drive(filename)
 
-        blob = bucket.blob(f"relief/{filename}")
-        blob.upload_from_filename(filename, content_type="image/jpeg")
+        if update.message.media_group_id:
+            terima_album(update, context)
+            return
 
-        image_url = blob.generate_signed_url(version="v4", expiration=60*60*24*7, method="GET")
+        photo = update.message.photo[-1]
 
-        context.user_data.setdefault("images", []).append(image_url)
-        if len(context.user_data["images"]) < 2:
+        # Gambar pertama mula dimuat naik di latar belakang; bila gambar
+        # kedua sampai, kedua-duanya ditunggu serentak.
+        tasks = upload_tertunda.setdefault(user.id, [])
+        tasks.append(context.application.create_task(
+            muat_naik_ke_user_data(photo, nama_fail_gambar(user.id, photo), context.user_data, tasks, update.message),
+            update=update
+        ))
+        if len(context.user_data.get("images", [])) + len(tasks) < 2:
             return
 
-        img1, img2 = context.user_data["images"]
+        await asyncio.gather(*list(tasks))
+        await rekod_jika_lengkap(user.id, context.user_data, update.message)
 
-        tarikh_iso = context.user_data.get(
-            "tarikh", datetime.now().strftime("%Y-%m-%d")
+    except Exception as e:
+        print("SYSTEM ERROR:", e)
+        metrics.ralat("handler", "gambar")
+        await update.message.reply_text(
+            "⚠️ Berlaku ralat semasa proses muat naik.\nSila cuba semula atau maklumkan pentadbir."
         )
 
-        sheet = get_sheet_by_month(tarikh_iso)
-
-        # LATEST DI ATAS (ROW 2)
-        sheet.insert_row([
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            tarikh_iso,
-            context.user_data.get("masa", ""),
-            context.user_data.get("guru_pengganti", ""),
-            context.user_data.get("guru_diganti", ""),
-            context.user_data.get("kelas", ""),
-            context.user_data.get("subjek", ""),
-            img1,
-            img2,
-            "",
-            ""
-        ], 2)
-
-        sheet.update("J2", [["=IMAGE(H2)"]], value_input_option="USER_ENTERED")
-        sheet.update("K2", [["=IMAGE(I2)"]], value_input_option="USER_ENTERED")
-
-        context.user_data.clear()
-        await update.message.reply_text("✅ Rekod kelas relief berjaya dihantar.\nTerima kasih cikgu 😊")
 
+# ==================================================
+# PERSISTENCE STATE ALIRAN (SQLITE)
+# ==================================================
+# user_data aliran check-in (tarikh -> masa -> ... -> gambar) disimpan
+# dalam SQLite supaya guru boleh sambung selepas restart. PTB panggil
+# update_user_data setiap PERSISTENCE_INTERVAL saat; semua perubahan dalam
+# satu kitaran ditulis dalam satu transaksi. Seperti journal, fail ini
+# mesti pada storan kekal (DATA_DIR / STATE_PATH, lihat STORAN KEKAL).
+STATE_PATH = laluan_data("STATE_PATH", "relief_state.db")
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", "10"))
+
+FLOW_KEYS = (
+    "tarikh", "masa", "guru_pengganti", "guru_diganti", "kelas", "subjek",
+    "images", "calendar_year", "calendar_month", "last_message_id"
+)
+
+
+class SqlitePersistence(BasePersistence):
+    def __init__(self, path=STATE_PATH, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_state ("
+            " user_id INTEGER PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._terakhir = {}
+        self._pending = {}
+        self._flush_task = None
+
+    @staticmethod
+    def _ringkas(data):
+        ringkas = {k: data[k] for k in FLOW_KEYS if data.get(k) not in (None, "", [])}
+        if not ringkas:
+            return None
+        return json.dumps(ringkas, separators=(",", ":"), ensure_ascii=False)
+
+    def _tulis_sync(self, pending):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?)",
+                [(uid, data, now) for uid, data in pending.items() if data is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM user_state WHERE user_id = ?",
+                [(uid,) for uid, data in pending.items() if data is None]
+            )
+            self._conn.commit()
+
+    async def _tulis(self):
+        # beri peluang semua update_user_data dalam kitaran ini berkumpul
+        await asyncio.sleep(0)
+        pending, self._pending = self._pending, {}
+        if pending:
+            await asyncio.get_running_loop().run_in_executor(io_executor, self._tulis_sync, pending)
+
+    def _tanda(self, user_id, data):
+        if self._terakhir.get(user_id) == data:
+            return
+        self._terakhir[user_id] = data
+        self._pending[user_id] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._tulis())
+
+    async def get_user_data(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, data FROM user_state").fetchall()
+        hasil = {}
+        for uid, data in rows:
+            self._terakhir[uid] = data
+            hasil[uid] = json.loads(data)
+        return hasil
+
+    async def update_user_data(self, user_id, data):
+        self._tanda(user_id, self._ringkas(data))
+
+    async def drop_user_data(self, user_id):
+        self._tanda(user_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._tulis()
+
+    # chat_data / bot_data / callback_data / conversation tidak digunakan
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+# ==================================================
+# MOD WEBHOOK & PEMPROSESAN SERENTAK
+# ==================================================
+# WEBHOOK_URL ditetapkan -> terima update melalui webhook (HTTP listener
+# terbina dalam PTB). Tanpa WEBHOOK_URL -> run_polling() seperti biasa.
+# Deploy: router Heroku/Dokku hanya menghantar trafik HTTP ke proses web:,
+# jadi mod webhook dijalankan sebagai proses "web" (Procfile) yang mendengar
+# pada $PORT, dan mod polling sebagai "worker". Skala HANYA satu daripadanya
+# (cth. `ps:scale web=1 worker=0`): setWebhook mematikan getUpdates, dan
+# polling memadam webhook. WEBHOOK_URL ialah URL awam aplikasi (https://...).
+# Update daripada guru berbeza diproses serentak; update seorang guru
+# tetap diproses ikut turutan supaya aliran user_data tidak bercelaru.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or None
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("PORT", "8443"))
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "16"))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # id -> [asyncio.Lock, bilangan update yang sedang menunggu]
+        self._locks = {}
+
+    @staticmethod
+    def _kunci(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+        if update.effective_chat is not None:
+            return ("chat", update.effective_chat.id)
+        return None
+
+    async def process_update(self, update, coroutine):
+        # PTB asal ambil semaphore dahulu, kemudian do_process_update: update
+        # yang menunggu giliran guru yang sama memegang slot CONCURRENT_UPDATES
+        # dan boleh menyekat guru lain. Di sini kunci guru diambil DAHULU.
+        kunci = self._kunci(update)
+        if kunci is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+
+        entry = self._locks.setdefault(kunci, [asyncio.Lock(), 0])
+        entry[1] += 1
         try:
-            os.remove(filename)
-        except:
-            pass
+            async with entry[0]:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[kunci]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
 
-    except Exception as e:
-        print("SYSTEM ERROR:", e)
-        await update.message.reply_text(
-            "⚠️ Berlaku ralat semasa proses muat naik.\nSila cuba semula atau maklumkan pentadbir."
+    async def shutdown(self):
+        pass
+
+
+def guna_webhook():
+    if "--polling" in sys.argv:
+        return False
+    if "--webhook" in sys.argv and not WEBHOOK_URL:
+        # tanpa WEBHOOK_URL, Telegram didaftarkan dengan URL "/telegram"
+        raise RuntimeError(
+            "--webhook memerlukan WEBHOOK_URL (URL awam https aplikasi, cth. https://nama-app.herokuapp.com)."
         )
+    return "--webhook" in sys.argv or bool(WEBHOOK_URL)
 
 
 # ==================================================
 # RUN BOT
 # ==================================================
+# task latar belakang yang dimulakan semasa startup
+latar_tasks = []
+
+
+def sedia_carta():
+    # dijalankan dalam proses carta: import matplotlib (Agg) lebih awal
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure  # noqa: F401
+
+
+async def on_startup(app):
+    startup_timer.rekod("sedia untuk polling", time.perf_counter() - _T0)
+    if STARTUP_PROFILE:
+        print(startup_timer.laporan())
+
+    # proses carta di-fork awal, sebelum thread I/O bermula; matplotlib
+    # diimport dalam proses itu, bukan dalam proses bot
+    if CHART_BACKEND != "reportlab":
+        get_chart_pool().submit(sedia_carta)
+    latar_tasks.append(asyncio.create_task(loop_lag_monitor()))
+    mula_metrics_server()
+    # client Sheets & Firebase tenant lalai dipanaskan di latar belakang,
+    # berserta indeks konflik bulan semasa & kaunter beban penggal; sekolah
+    # lain dibuka bila update pertamanya tiba
+    if tenant_pool.lalai() is not None:
+        io_executor.submit(conflict_index.ensure, date.today().strftime("%Y-%m-%d"))
+        io_executor.submit(load_index.ensure, date.today().strftime("%Y-%m-%d"))
+        io_executor.submit(get_bucket)
+    # rekod tertunda dari proses sebelum restart akan di-flush dahulu
+    flusher.start()
+    flusher.notify()
+    latar_tasks.append(asyncio.create_task(reconcile_loop()))
+    latar_tasks.append(asyncio.create_task(usir_tenant_loop()))
+
+
+async def on_shutdown(app):
+    for task in latar_tasks:
+        task.cancel()
+    latar_tasks.clear()
+    await flusher.stop()
+    tutup_chart_pool()
+
+
+def profil_startup():
+    # Mod ukur: jalankan setiap fasa init secara eager & cetak tempohnya
+    with startup_timer.phase("bina Application"):
+        ApplicationBuilder().token(TOKEN).build()
+    # app Firebase & client gspread diukur oleh lazy_client; dipanggil dahulu
+    # supaya fasa handle bucket & open_by_key tidak mengira semula masanya
+    get_firebase_app()
+    with startup_timer.phase("storage.bucket"):
+        get_bucket()
+    get_gc()
+    with startup_timer.phase("gc.open_by_key"):
+        get_spreadsheet()
+    with startup_timer.phase("import reportlab"):
+        import reportlab.platypus  # noqa: F401
+    if CHART_BACKEND == "reportlab":
+        with startup_timer.phase("import reportlab.graphics"):
+            import reportlab.graphics.charts.barcharts  # noqa: F401
+    else:
+        with startup_timer.phase("import matplotlib"):
+            sedia_carta()
+    with startup_timer.phase("import PIL"):
+        import PIL.Image  # noqa: F401
+
+    print(startup_timer.laporan())
+
+
 def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+    if "--profile-startup" in sys.argv:
+        profil_startup()
+        return
+
+    webhook = guna_webhook()
+    pastikan_storan_kekal(JOURNAL_PATH=JOURNAL_PATH, STATE_PATH=STATE_PATH)
+
+    with startup_timer.phase("bina Application"):
+        builder = (
+            ApplicationBuilder()
+            .token(TOKEN)
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
+            .persistence(SqlitePersistence())
+            .request(MeteredRequest(connection_pool_size=256))
+        )
+        if CONCURRENT_UPDATES > 1:
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        app = builder.build()
 
+    app.add_handler(TypeHandler(Update, pilih_tenant), group=-1)
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("eksport", eksport))
     app.add_handler(MessageHandler(filters.TEXT & filters.Regex("^🟢 Hari Ini$"), hari_ini))
     app.add_handler(MessageHandler(filters.TEXT & filters.Regex("^📅 Tarikh Lain$"), tarikh_lain))
     app.add_handler(MessageHandler(filters.TEXT & filters.Regex("Semak Rekod"), semak_rekod))
@@ -694,9 +3771,22 @@ def main():
     app.add_handler(MessageHandler(filters.PHOTO, gambar))
     app.add_handler(MessageHandler(filters.TEXT & filters.Regex("Analisis Mingguan \\(PDF\\)"), analisis_pdf))
 
+    jadual_laporan(app)
+    jadual_refresh_pautan(app)
+    jadual_arkib(app)
+
 
     print("🤖 Bot Relief (Firebase) sedang berjalan...")
-    app.run_polling()
+    if webhook:
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET
+        )
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":